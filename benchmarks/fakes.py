@@ -0,0 +1,249 @@
+import io
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import types
+import zlib
+
+import boto3
+from langchain_core.documents import Document
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+# Directory holding the Lambda modules, which import each other as top-level modules
+LAMBDA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "lambdafiles")
+
+_WORDS = ("tenderer", "criterion", "compliance", "proposal", "schedule", "pricing", "safety",
+          "experience", "methodology", "resources", "evidence", "score", "requirement", "submission")
+
+
+class LatencyProfile:
+    """
+    Simulated service latencies and model speed used by the fakes.
+    Every delay is in seconds; `jitter` spreads each delay uniformly by that fraction.
+    """
+
+    def __init__(self, s3_latency=0.02, retrieve_latency=0.15, first_token_latency=0.4,
+                 tokens_per_second=80.0, response_tokens=120, chunks_per_retrieve=4,
+                 chunk_chars=1500, criteria_chars=6000, jitter=0.1, seed=0):
+        self.s3_latency = s3_latency
+        self.retrieve_latency = retrieve_latency
+        self.first_token_latency = first_token_latency
+        self.tokens_per_second = tokens_per_second
+        self.response_tokens = response_tokens
+        self.chunks_per_retrieve = chunks_per_retrieve
+        self.chunk_chars = chunk_chars
+        self.criteria_chars = criteria_chars
+        self.jitter = jitter
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def sleep(self, seconds):
+        if seconds <= 0:
+            return
+        with self._lock:
+            spread = self._random.uniform(-self.jitter, self.jitter)
+        time.sleep(seconds * (1 + spread))
+
+    def as_dict(self):
+        return {key: value for key, value in vars(self).items() if not key.startswith("_")}
+
+
+profile = LatencyProfile()
+
+
+def add_profile_arguments(parser):
+    """Add command-line options for the simulated latencies to an argparse parser."""
+    parser.add_argument("--s3-latency", type=float, default=0.02, help="Seconds per S3 call")
+    parser.add_argument("--retrieve-latency", type=float, default=0.15, help="Seconds per Knowledge Base retrieval")
+    parser.add_argument("--first-token-latency", type=float, default=0.4, help="Seconds before the first model token")
+    parser.add_argument("--tokens-per-second", type=float, default=80.0, help="Model output token rate")
+    parser.add_argument("--response-tokens", type=int, default=120, help="Tokens in each model response")
+    parser.add_argument("--chunks", type=int, default=4, help="Chunks returned per retrieval when not configured")
+    parser.add_argument("--jitter", type=float, default=0.1, help="Uniform spread applied to every delay")
+    parser.add_argument("--scale", type=float, default=1.0, help="Multiply every simulated delay, e.g. 0.1 for quick runs")
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def profile_from_args(args):
+    """Build a LatencyProfile from the options added by add_profile_arguments."""
+    return LatencyProfile(
+        s3_latency=args.s3_latency * args.scale,
+        retrieve_latency=args.retrieve_latency * args.scale,
+        first_token_latency=args.first_token_latency * args.scale,
+        tokens_per_second=args.tokens_per_second / args.scale,
+        response_tokens=args.response_tokens,
+        chunks_per_retrieve=args.chunks,
+        jitter=args.jitter,
+        seed=args.seed,
+    )
+
+
+def _text(chars, salt=0):
+    words = []
+    length = 0
+    index = salt
+    while length < chars:
+        word = _WORDS[index % len(_WORDS)]
+        words.append(word)
+        length += len(word) + 1
+        index += 7
+    return " ".join(words)
+
+
+# ------------------------------------------------------
+# AWS clients
+
+class FakeS3Client:
+    """In-memory S3 client covering the calls the Lambda and the apps make."""
+
+    def __init__(self, *args, **kwargs):
+        self.objects = {}
+
+    def get_object(self, Bucket, Key):
+        profile.sleep(profile.s3_latency)
+        body = self.objects.get((Bucket, Key))
+        if body is None:
+            # Anything not written by the benchmark reads as synthetic evaluation criteria
+            body = _text(profile.criteria_chars).encode("utf-8")
+        return {"Body": io.BytesIO(body), "ETag": '"bench"'}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        profile.sleep(profile.s3_latency)
+        self.objects[(Bucket, Key)] = Body if isinstance(Body, bytes) else Body.read()
+        return {"ETag": '"bench"'}
+
+    def head_object(self, Bucket, Key):
+        return {"ETag": '"bench"'}
+
+    def generate_presigned_url(self, ClientMethod, Params, ExpiresIn=3600):
+        return f"https://{Params['Bucket']}.s3.localhost/{Params['Key']}?X-Amz-Expires={ExpiresIn}"
+
+
+class FakeServiceClient:
+    """Placeholder for clients that are only handed to the fake retriever and model."""
+
+    def __init__(self, service_name, *args, **kwargs):
+        self.service_name = service_name
+
+    def invoke(self, **kwargs):
+        return {"StatusCode": 202}
+
+
+def fake_boto3_client(service_name, *args, **kwargs):
+    if service_name == "s3":
+        return FakeS3Client()
+    return FakeServiceClient(service_name)
+
+
+# ------------------------------------------------------
+# LangChain AWS integrations
+
+# Question -> golden set references the fake retriever returns among its results,
+# so retrieval_eval.py can be exercised offline
+golden_chunks = {}
+
+
+def _chunk_document(source_document, chunk_id, page, text, rank):
+    return Document(
+        page_content=text,
+        metadata={
+            "location": {"type": "S3", "s3Location": {
+                "uri": f"s3://tender-eval-bucket/processed-doc-files/{os.path.basename(source_document)}/{chunk_id}.txt"}},
+            "score": round(0.9 - 0.05 * rank, 3),
+            "source_metadata": {"source_document": source_document, "chunk_id": chunk_id,
+                                "page_start": page, "page_end": page + 1},
+        },
+    )
+
+class FakeKnowledgeBasesRetriever:
+    """Stand-in for AmazonKnowledgeBasesRetriever returning synthetic chunks after a delay."""
+
+    def __init__(self, knowledge_base_id=None, retrieval_config=None, client=None, **kwargs):
+        self.knowledge_base_id = knowledge_base_id
+        self.retrieval_config = retrieval_config or {}
+        self.client = client
+
+    def invoke(self, query, config=None, **kwargs):
+        search = self.retrieval_config.get("vectorSearchConfiguration", {})
+        count = search.get("numberOfResults", profile.chunks_per_retrieve)
+        hybrid = search.get("overrideSearchType") == "HYBRID"
+        # Larger result sets and hybrid search take a little longer, as in the service
+        profile.sleep(profile.retrieve_latency * (1 + 0.02 * count) * (1.25 if hybrid else 1))
+        documents = search.get("filter", {}).get("orAll", [{}])[0].get("in", {}).get("value") or ["tender.pdf"]
+        results = [
+            _chunk_document(documents[rank % len(documents)], f"chunk-{rank}", 2 * rank + 1,
+                            _text(profile.chunk_chars, salt=zlib.crc32(query.encode("utf-8")) + rank), rank)
+            for rank in range(count)
+        ]
+        for reference in golden_chunks.get(query, []):
+            # Expected chunks sit at a fixed depth per question; hybrid search ranks them higher
+            rank = max(0, zlib.crc32(f"{query}\n{reference}".encode("utf-8")) % 10 - (2 if hybrid else 0))
+            if rank < count:
+                source, _, page = reference.partition("#p")
+                if page:
+                    results[rank] = _chunk_document(source, f"golden-{rank}", int(page), results[rank].page_content, rank)
+                else:
+                    results[rank] = _chunk_document(documents[0], reference, 1, results[rank].page_content, rank)
+        return results
+
+    get_relevant_documents = invoke
+
+
+class FakeChatBedrock:
+    """Stand-in for ChatBedrock that streams synthetic tokens at the profile's rate."""
+
+    def __init__(self, client=None, model_id=None, model_kwargs=None, **kwargs):
+        self.client = client
+        self.model_id = model_id
+        self.model_kwargs = model_kwargs or {}
+
+    def _tokens(self):
+        for index in range(profile.response_tokens):
+            yield _WORDS[index % len(_WORDS)] + " "
+
+    def stream(self, input, config=None, **kwargs):
+        profile.sleep(profile.first_token_latency)
+        delay = 1.0 / profile.tokens_per_second if profile.tokens_per_second else 0
+        for index, token in enumerate(self._tokens()):
+            if index:
+                profile.sleep(delay)
+            yield AIMessageChunk(content=token)
+
+    def invoke(self, input, config=None, **kwargs):
+        return AIMessage(content="".join(chunk.content for chunk in self.stream(input)))
+
+
+# ------------------------------------------------------
+# Loading the Lambda against the fakes
+
+def load_lambda(latency=None, work_dir=None):
+    """
+    Import tenderevalbedrockapi with boto3 clients and the LangChain AWS integrations
+    replaced by the fakes above. Sessions, usage and jobs are kept in `work_dir`, jobs run on
+    local threads and the rate governors are opened wide unless configured in the
+    environment. Returns the imported module.
+    """
+    global profile
+    if latency is not None:
+        profile = latency
+    work_dir = work_dir or tempfile.mkdtemp(prefix="tender-eval-bench-")
+    os.environ.setdefault("SESSION_DB_PATH", os.path.join(work_dir, "sessions.db"))
+    os.environ.setdefault("USAGE_DB_PATH", os.path.join(work_dir, "usage.db"))
+    os.environ.setdefault("JOB_STORE_DIR", os.path.join(work_dir, "jobs"))
+    os.environ.setdefault("JOB_RUNNER", "thread")
+    for name in ("MODEL_REQUESTS_PER_MINUTE", "MODEL_TOKENS_PER_MINUTE", "RETRIEVE_REQUESTS_PER_MINUTE"):
+        os.environ.setdefault(name, str(10 ** 9))
+
+    fake_aws = types.ModuleType("langchain_aws")
+    fake_aws.ChatBedrock = FakeChatBedrock
+    fake_aws.AmazonKnowledgeBasesRetriever = FakeKnowledgeBasesRetriever
+    sys.modules["langchain_aws"] = fake_aws
+    boto3.client = fake_boto3_client
+
+    if LAMBDA_DIR not in sys.path:
+        sys.path.insert(0, LAMBDA_DIR)
+    import tenderevalbedrockapi
+    return tenderevalbedrockapi
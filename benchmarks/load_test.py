@@ -0,0 +1,274 @@
+"""
+Concurrent-session load generator for the evaluation API.
+
+Simulates evaluators using the chat apps against an endpoint: each session asks
+questions with think time in between, so its server-side history grows turn by
+turn, and starts a new conversation after --turns-per-session questions. Every
+--burst-interval seconds a group of sessions presses "Evaluate and Summarise" at
+the same moment, submitting the standard report as an asynchronous job and
+polling it to completion, as test_tender_predefined.py does.
+
+The number of sessions is ramped in steps (--levels). Each step reports
+throughput, the latency distribution of chat turns and reports, and the error
+classes seen (throttled, timeout, HTTP and Lambda errors). Ramping stops at the
+saturation point: the first step where the error rate or chat p95 exceeds its
+limit, or where throughput grows by less than --min-gain over the previous step.
+
+    # Offline, against the local stand-in with the benchmark fakes
+    python -m benchmarks.load_test --local --levels 1 2 4 8 16 32 --scale 0.2
+
+    # Against a deployment (this invokes Bedrock and is billed)
+    python -m benchmarks.load_test --url https://<api-id>.execute-api.us-east-1.amazonaws.com/dev/ask
+
+Set MODEL_REQUESTS_PER_MINUTE and the other governor limits in the environment to
+reproduce a deployment's quotas in --local runs.
+"""
+import argparse
+import contextlib
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+import requests
+
+from benchmarks.fakes import add_profile_arguments, load_lambda, profile_from_args
+from benchmarks.run_benchmarks import summarize
+from benchmarks.standin import start_server
+from components.report_cache import STANDARD_REPORT_QUESTION
+
+QUESTIONS = [
+    "Does the Tenderer meet the mandatory insurance requirements?",
+    "Summarise the Tenderer's safety management approach.",
+    "What experience does the Tenderer have with projects of similar scale?",
+    "How does the proposed methodology address the delivery schedule?",
+    "Are there any gaps in the submitted pricing schedule?",
+    "Which key personnel are nominated and what are their qualifications?",
+    "What quality assurance processes does the Tenderer describe?",
+    "List any departures from the conditions of contract.",
+    "How does the Tenderer propose to manage subcontractors?",
+    "What environmental management commitments are made?",
+]
+
+
+class LoadRecorder:
+    """Thread-safe collection of request outcomes for the current step."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.records = []
+
+    def add(self, kind, latency, outcome):
+        with self._lock:
+            self.records.append((kind, latency, outcome))
+
+    def take(self):
+        with self._lock:
+            records, self.records = self.records, []
+        return records
+
+
+def post(url, payload, timeout):
+    """
+    POST a payload and return (decoded body, outcome), where outcome is "ok" or an
+    error class. Unlike the app client, throttled requests are not retried.
+    """
+    try:
+        response = requests.post(url, json=payload, timeout=timeout)
+    except requests.exceptions.Timeout:
+        return None, "timeout"
+    except requests.exceptions.ConnectionError:
+        return None, "connection_error"
+    if response.status_code == 429:
+        return None, "throttled"  # API Gateway throttling
+    if response.status_code >= 400:
+        return None, f"http_{response.status_code}"
+    try:
+        data = response.json()
+        body = json.loads(data["body"]) if "body" in data else data
+    except (ValueError, TypeError):
+        return None, "invalid_response"
+    status = data.get("statusCode", 200)
+    if body.get("retryable") or status == 429:
+        return body, "throttled"  # The Lambda's rate governor gave up after retries
+    if status >= 400:
+        return body, f"lambda_{status}"
+    return body, "ok"
+
+
+# ------------------------------------------------------
+# Simulated users
+
+def chat_session(url, args, recorder, stop, rng):
+    """Ask questions in one conversation after another until the step ends."""
+    while not stop.is_set():
+        session_id = f"load-{uuid.uuid4().hex}"
+        for _ in range(args.turns_per_session):
+            if stop.wait(rng.expovariate(1.0 / args.think_time) if args.think_time else 0):
+                return
+            started = time.perf_counter()
+            _, outcome = post(url, {"session_id": session_id, "question": rng.choice(QUESTIONS)}, args.timeout)
+            recorder.add("chat", time.perf_counter() - started, outcome)
+        post(url, {"action": "clear_history", "session_id": session_id}, args.timeout)
+
+
+def evaluate(url, args, recorder):
+    """Submit the standard report as a job and poll it until it finishes."""
+    started = time.perf_counter()
+    payload = {"action": "submit_job", "session_id": f"load-{uuid.uuid4().hex}",
+               "question": STANDARD_REPORT_QUESTION, "priority": "interactive"}
+    submitted, outcome = post(url, payload, args.timeout)
+    deadline = started + args.report_timeout
+    while outcome == "ok":
+        if time.perf_counter() > deadline:
+            outcome = "report_timeout"
+            break
+        time.sleep(args.poll_seconds)
+        record, outcome = post(url, {"action": "poll_job", "job_id": submitted["job_id"]}, args.timeout)
+        if outcome != "ok" or record["status"] == "succeeded":
+            break
+        if record["status"] == "failed":
+            outcome = "throttled" if record.get("retryable") else "report_failed"
+    recorder.add("evaluate", time.perf_counter() - started, outcome)
+
+
+def evaluate_bursts(url, args, recorder, stop, sessions):
+    """Every burst interval, have a share of the sessions press Evaluate together."""
+    workers = []
+    while not stop.wait(args.burst_interval):
+        for _ in range(max(1, round(sessions * args.burst_share))):
+            worker = threading.Thread(target=evaluate, args=(url, args, recorder), daemon=True)
+            worker.start()
+            workers.append(worker)
+    for worker in workers:
+        worker.join(args.report_timeout)
+
+
+# ------------------------------------------------------
+# Ramp
+
+def run_step(url, args, sessions):
+    recorder = LoadRecorder()
+    stop = threading.Event()
+    threads = [threading.Thread(target=chat_session, args=(url, args, recorder, stop, random.Random(args.seed + n)),
+                                daemon=True) for n in range(sessions)]
+    if args.burst_interval:
+        threads.append(threading.Thread(target=evaluate_bursts, args=(url, args, recorder, stop, sessions), daemon=True))
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(args.step_seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    records = recorder.take()
+    outcomes = Counter(outcome for _, _, outcome in records)
+    ok = outcomes.pop("ok", 0)
+    return {
+        "sessions": sessions,
+        "seconds": round(elapsed, 1),
+        "requests": len(records),
+        "throughput_rps": round(ok / elapsed, 2),
+        "error_rate": round(sum(outcomes.values()) / len(records), 3) if records else 0.0,
+        "errors": dict(outcomes),
+        "chat_latency_ms": summarize([latency * 1000 for kind, latency, outcome in records
+                                      if kind == "chat" and outcome == "ok"]),
+        "evaluate_latency_ms": summarize([latency * 1000 for kind, latency, outcome in records
+                                          if kind == "evaluate" and outcome == "ok"]),
+    }
+
+
+def saturation_reason(step, previous, args):
+    """Return why a step is past the saturation point, or None if it is not."""
+    if step["error_rate"] > args.max_error_rate:
+        return f"error rate {step['error_rate']:.1%} above {args.max_error_rate:.1%}"
+    p95 = (step["chat_latency_ms"] or {}).get("p95")
+    if args.slo_p95_ms and p95 and p95 > args.slo_p95_ms:
+        return f"chat p95 {p95:.0f} ms above {args.slo_p95_ms:.0f} ms"
+    if previous and step["throughput_rps"] < previous["throughput_rps"] * (1 + args.min_gain):
+        return f"throughput grew less than {args.min_gain:.0%} ({previous['throughput_rps']} -> {step['throughput_rps']} req/s)"
+    return None
+
+
+def print_step(step, file=None):
+    chat = step["chat_latency_ms"] or {}
+    report = step["evaluate_latency_ms"] or {}
+    errors = ", ".join(f"{name}={count}" for name, count in sorted(step["errors"].items())) or "-"
+    print(f"{step['sessions']:>8}{step['requests']:>10}{step['throughput_rps']:>9}"
+          f"{chat.get('p50', '-'):>10}{chat.get('p95', '-'):>10}{chat.get('p99', '-'):>10}"
+          f"{report.get('p50', '-'):>12}{report.get('p95', '-'):>12}  {errors}", file=file, flush=True)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--url", help="Endpoint to load, e.g. the API Gateway /ask URL")
+    target.add_argument("--local", action="store_true", help="Start a local stand-in server with the benchmark fakes")
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32],
+                        help="Concurrent sessions in each ramp step")
+    parser.add_argument("--step-seconds", type=float, default=60.0)
+    parser.add_argument("--think-time", type=float, default=5.0, help="Mean seconds between a session's questions")
+    parser.add_argument("--turns-per-session", type=int, default=10, help="Questions before a session starts over")
+    parser.add_argument("--burst-interval", type=float, default=20.0, help="Seconds between Evaluate bursts, 0 for none")
+    parser.add_argument("--burst-share", type=float, default=0.25, help="Share of sessions pressing Evaluate in a burst")
+    parser.add_argument("--poll-seconds", type=float, default=1.0, help="Job poll interval of Evaluate requests")
+    parser.add_argument("--timeout", type=float, default=30.0, help="Seconds per HTTP request, as API Gateway allows")
+    parser.add_argument("--report-timeout", type=float, default=900.0)
+    parser.add_argument("--max-error-rate", type=float, default=0.01)
+    parser.add_argument("--slo-p95-ms", type=float, default=10000.0, help="Chat p95 latency limit, 0 to disable")
+    parser.add_argument("--min-gain", type=float, default=0.10, help="Throughput growth expected from a larger step")
+    parser.add_argument("--keep-going", action="store_true", help="Run every level even past the saturation point")
+    parser.add_argument("--save", help="Write the step results to this JSON file")
+    add_profile_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    out = sys.stdout
+    url = args.url
+    server = None
+    with contextlib.ExitStack() as stack:
+        if args.local:
+            # The in-process Lambda prints debugging output and metrics on every call
+            stack.enter_context(contextlib.redirect_stdout(stack.enter_context(open(os.devnull, "w"))))
+            server, url = start_server(load_lambda(profile_from_args(args)))
+            stack.callback(server.shutdown)
+
+        print(f"{'sessions':>8}{'requests':>10}{'req/s':>9}{'chat p50':>10}{'chat p95':>10}{'chat p99':>10}"
+              f"{'report p50':>12}{'report p95':>12}  errors", file=out)
+        steps, saturation, previous = [], None, None
+        for sessions in args.levels:
+            step = run_step(url, args, sessions)
+            steps.append(step)
+            print_step(step, file=out)
+            reason = saturation_reason(step, previous, args)
+            if reason and saturation is None:
+                saturation = {"sessions": previous["sessions"] if previous else None,
+                              "throughput_rps": previous["throughput_rps"] if previous else None,
+                              "saturated_at": sessions, "reason": reason}
+                if not args.keep_going:
+                    break
+            previous = step
+
+    if saturation:
+        print(f"\nSaturation at {saturation['saturated_at']} sessions: {saturation['reason']}.")
+        if saturation["sessions"]:
+            print(f"Last healthy level: {saturation['sessions']} sessions at {saturation['throughput_rps']} req/s.")
+    else:
+        print(f"\nNo saturation up to {args.levels[-1]} sessions.")
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump({"target": "local" if args.local else url, "steps": steps, "saturation": saturation}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
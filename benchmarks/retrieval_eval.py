@@ -0,0 +1,158 @@
+"""
+Retrieval quality-vs-latency harness for choosing the Knowledge Base retrieval settings.
+
+Runs every question of a golden set through the Lambda's retriever at several
+numbers of results (k), search types (SEMANTIC, HYBRID) and scopes (limited to the
+question's documents, or the whole knowledge base), and reports for each setting:
+
+    recall@k   share of a question's expected chunks found in the results
+    MRR        mean reciprocal rank of the first expected chunk
+    tokens     context tokens added to the prompt (estimated like the rate governor)
+    latency    retrieval p50/p95, and p50 added over the cheapest setting
+
+The golden set is JSONL, one question per line:
+
+    {"question": "Does the Tenderer hold the required insurances?",
+     "documents": ["eval-doc-files/TenderA.pdf"],
+     "expected": ["eval-doc-files/TenderA.pdf#p12", "3f9c2a7d1b0e4c55"]}
+
+An expected entry matches a retrieved chunk by its chunk id (see the manifests in
+processed-doc-manifests/), its S3 URI, its source document, or as
+"<source document>#p<page>" when the chunk covers that page.
+
+    python -m benchmarks.retrieval_eval --golden golden.jsonl --k 2 4 6 8 10
+
+Set RETRIEVAL_K and RETRIEVAL_SEARCH_TYPE on the Lambda to the chosen setting.
+--local runs against the fake retriever to check the harness offline.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+from benchmarks import fakes
+from benchmarks.run_benchmarks import summarize
+
+STRATEGIES = ("SEMANTIC", "HYBRID")
+SCOPES = ("scoped", "unscoped")
+
+
+def load_golden_set(path):
+    with open(path, encoding="utf-8") as f:
+        items = [json.loads(line) for line in f if line.strip()]
+    for number, item in enumerate(items, start=1):
+        if not item.get("question") or not item.get("expected"):
+            raise ValueError(f"Golden set line {number} needs a 'question' and a non-empty 'expected' list")
+    return items
+
+
+def load_api(local):
+    if local:
+        return fakes.load_lambda()
+    if fakes.LAMBDA_DIR not in sys.path:
+        sys.path.insert(0, fakes.LAMBDA_DIR)
+    import tenderevalbedrockapi
+    return tenderevalbedrockapi
+
+
+def chunk_attributes(doc):
+    """Metadata attributes of a retrieved chunk, whichever way the retriever nests them."""
+    metadata = doc.metadata
+    return {**metadata, **(metadata.get("source_metadata") or {})}
+
+
+def matches(reference, doc):
+    attributes = chunk_attributes(doc)
+    uri = attributes.get("location", {}).get("s3Location", {}).get("uri", "")
+    source = attributes.get("source_document") or uri.split("/", 3)[-1]
+    document, _, page = reference.partition("#p")
+    if page:
+        try:
+            page_start = int(float(attributes.get("page_start")))
+            page_end = int(float(attributes.get("page_end", page_start)))
+        except (TypeError, ValueError):
+            return False
+        return source == document and page_start <= int(page) <= page_end
+    return reference in (attributes.get("chunk_id"), uri, source) or uri.endswith(f"/{reference}")
+
+
+def score_results(expected, docs):
+    """Return (recall, reciprocal rank) of the expected references in ranked results."""
+    found = {reference for reference in expected for doc in docs if matches(reference, doc)}
+    first_rank = next((rank for rank, doc in enumerate(docs, start=1)
+                       if any(matches(reference, doc) for reference in expected)), None)
+    return len(found) / len(expected), (1.0 / first_rank if first_rank else 0.0)
+
+
+def evaluate_setting(api, golden, k, strategy, scope, repeats):
+    recalls, reciprocal_ranks, tokens, latencies = [], [], [], []
+    for item in golden:
+        documents = tuple(sorted(item.get("documents") or ())) if scope == "scoped" else ()
+        retriever = api.get_retriever(documents, k=k, search_type=strategy)
+        for _ in range(repeats):
+            started = time.perf_counter()
+            docs = retriever.invoke(item["question"])
+            latencies.append((time.perf_counter() - started) * 1000)
+        recall, reciprocal_rank = score_results(item["expected"], docs)
+        recalls.append(recall)
+        reciprocal_ranks.append(reciprocal_rank)
+        tokens.append(sum(len(doc.page_content) for doc in docs) // 4)
+    return {
+        "k": k,
+        "strategy": strategy,
+        "scope": scope,
+        "recall": round(sum(recalls) / len(recalls), 3),
+        "mrr": round(sum(reciprocal_ranks) / len(reciprocal_ranks), 3),
+        "context_tokens": round(sum(tokens) / len(tokens)),
+        "latency_ms": summarize(latencies),
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--golden", required=True, help="Golden set JSONL file")
+    parser.add_argument("--k", type=int, nargs="+", default=[2, 4, 6, 8, 10], help="Numbers of results to try")
+    parser.add_argument("--strategies", nargs="+", choices=STRATEGIES, default=list(STRATEGIES))
+    parser.add_argument("--scopes", nargs="+", choices=SCOPES, default=list(SCOPES))
+    parser.add_argument("--repeats", type=int, default=3, help="Retrievals per question, for latency percentiles")
+    parser.add_argument("--local", action="store_true", help="Use the fake retriever instead of the knowledge base")
+    parser.add_argument("--save", help="Write the results to this JSON file")
+    fakes.add_profile_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    golden = load_golden_set(args.golden)
+    if args.local:
+        fakes.profile = fakes.profile_from_args(args)
+        fakes.golden_chunks.update({item["question"]: item["expected"] for item in golden})
+    api = load_api(args.local)
+
+    results = []
+    for scope in args.scopes:
+        for strategy in args.strategies:
+            for k in sorted(args.k):
+                print(f"Evaluating k={k} {strategy} {scope}...", file=sys.stderr)
+                results.append(evaluate_setting(api, golden, k, strategy, scope, args.repeats))
+
+    baseline = min(result["latency_ms"]["p50"] for result in results)
+    print(f"{len(golden)} questions, current setting k={api.RETRIEVAL_K} {api.RETRIEVAL_SEARCH_TYPE or 'default'}")
+    print(f"{'scope':<10}{'strategy':<10}{'k':>4}{'recall@k':>10}{'MRR':>8}{'tokens':>8}"
+          f"{'p50 ms':>10}{'p95 ms':>10}{'added ms':>10}")
+    for result in results:
+        latency = result["latency_ms"]
+        result["added_latency_ms"] = round(latency["p50"] - baseline, 2)
+        print(f"{result['scope']:<10}{result['strategy']:<10}{result['k']:>4}{result['recall']:>10}{result['mrr']:>8}"
+              f"{result['context_tokens']:>8}{latency['p50']:>10}{latency['p95']:>10}{result['added_latency_ms']:>10}")
+
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump({"golden_set": args.golden, "questions": len(golden), "results": results}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,313 @@
+"""
+Offline end-to-end latency benchmarks for the evaluation API.
+
+S3, the Knowledge Base retriever and the Bedrock chat model are replaced by local
+fakes with configurable latency and token rate (see benchmarks/fakes.py), so runs
+need no AWS access and measure the code paths between the services:
+
+    query_bedrock   the LangChain chain called by the Lambda
+    stream_bedrock  the streaming path used by jobs, with time to first token
+    lambda_handler  the Lambda entry point, including the session store
+    call_lambda     the Streamlit client path over HTTP to a local stand-in server
+    job             submit, poll and fetch of an asynchronous job over HTTP
+
+Each scenario reports p50/p95/p99 latency, time to first token where the path
+streams, allocations per call (tracemalloc) and throughput at the configured
+concurrency. Save a run as a baseline and compare later runs against it:
+
+    python -m benchmarks.run_benchmarks --save benchmarks/baselines/main.json
+    python -m benchmarks.run_benchmarks --compare benchmarks/baselines/main.json
+
+Comparison exits with status 1 when a metric regresses by more than --tolerance.
+"""
+import argparse
+import contextlib
+import json
+import math
+import os
+import platform
+import sys
+import time
+import tracemalloc
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.fakes import add_profile_arguments, load_lambda, profile_from_args
+from benchmarks.standin import start_server
+
+SCENARIOS = ("query_bedrock", "stream_bedrock", "lambda_handler", "call_lambda", "job")
+
+QUESTION = "How does the Tenderer's proposal address the safety management criterion?"
+HISTORY = [
+    {"role": "user", "content": "Summarise the Tenderer's methodology."},
+    {"role": "assistant", "content": "The Tenderer proposes a staged delivery with weekly progress reporting."},
+]
+
+# Metrics compared against a baseline; True when a higher value is better
+COMPARED_METRICS = {
+    ("latency_ms", "p50"): False,
+    ("latency_ms", "p95"): False,
+    ("latency_ms", "p99"): False,
+    ("ttft_ms", "p50"): False,
+    ("alloc_kb", "peak_mean"): False,
+    ("throughput_rps",): True,
+}
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a list of numbers."""
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, math.ceil(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(values):
+    if not values:
+        return None
+    return {
+        "p50": round(percentile(values, 0.50), 2),
+        "p95": round(percentile(values, 0.95), 2),
+        "p99": round(percentile(values, 0.99), 2),
+        "mean": round(sum(values) / len(values), 2),
+        "max": round(max(values), 2),
+    }
+
+
+# ------------------------------------------------------
+# Scenarios: each runs one request and returns its time to first token, or None
+
+def build_scenarios(api, lambda_client, request_key):
+    def question(index):
+        # Distinct questions, so concurrent requests are not coalesced into one call
+        return f"{QUESTION} (#{index})"
+
+    def run_query_bedrock(index):
+        api.query_bedrock(question(index), HISTORY)
+
+    def run_stream_bedrock(index):
+        started = time.perf_counter()
+        first = []
+
+        def on_partial(text):
+            if not first:
+                first.append(time.perf_counter() - started)
+
+        api.stream_bedrock(question(index), HISTORY, on_partial=on_partial)
+        return first[0] if first else None
+
+    def run_lambda_handler(index):
+        response = api.lambda_handler({"session_id": f"bench-{uuid.uuid4().hex}", "question": question(index)}, None)
+        if response["statusCode"] != 200:
+            raise RuntimeError(json.loads(response["body"]).get("error", response["statusCode"]))
+
+    def run_call_lambda(index):
+        payload = {"session_id": f"bench-{uuid.uuid4().hex}", "question": question(index), "documents": None}
+        response = lambda_client.post_coalesced(payload, request_key(payload["question"], "bench"))
+        if "response" not in response:
+            raise RuntimeError(response.get("error", "No response"))
+
+    def run_job(index):
+        payload = {"session_id": f"bench-{uuid.uuid4().hex}", "question": question(index), "priority": "background"}
+        started = time.perf_counter()
+        first = None
+        record = {}
+        for record in lambda_client.stream_job(payload, request_key(payload["question"], "bench")):
+            if first is None and record.get("partial_response"):
+                first = time.perf_counter() - started
+        if record.get("status") != "succeeded":
+            raise RuntimeError(record.get("error", "Job failed"))
+        return first
+
+    return {
+        "query_bedrock": run_query_bedrock,
+        "stream_bedrock": run_stream_bedrock,
+        "lambda_handler": run_lambda_handler,
+        "call_lambda": run_call_lambda,
+        "job": run_job,
+    }
+
+
+# ------------------------------------------------------
+# Measurement
+
+def timed(run, index):
+    started = time.perf_counter()
+    try:
+        ttft = run(index)
+        error = None
+    except Exception as e:
+        ttft, error = None, f"{type(e).__name__}: {e}"
+    return time.perf_counter() - started, ttft, error
+
+
+def measure_scenario(run, iterations, concurrency, alloc_iterations, warmup):
+    for index in range(warmup):
+        timed(run, -1 - index)
+
+    # Latency and time to first token, one request at a time
+    latencies, ttfts, errors = [], [], []
+    for index in range(iterations):
+        latency, ttft, error = timed(run, index)
+        if error:
+            errors.append(error)
+            continue
+        latencies.append(latency * 1000)
+        if ttft is not None:
+            ttfts.append(ttft * 1000)
+
+    # Allocations per request
+    peaks, nets = [], []
+    tracemalloc.start()
+    try:
+        for index in range(alloc_iterations):
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            timed(run, iterations + index)
+            current, peak = tracemalloc.get_traced_memory()
+            peaks.append((peak - before) / 1024)
+            nets.append((current - before) / 1024)
+    finally:
+        tracemalloc.stop()
+
+    # Throughput with concurrent requests
+    offset = iterations + alloc_iterations
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        outcomes = list(pool.map(lambda index: timed(run, offset + index), range(iterations)))
+    elapsed = time.perf_counter() - started
+    errors.extend(error for _, _, error in outcomes if error)
+    completed = sum(1 for _, _, error in outcomes if not error)
+
+    return {
+        "iterations": iterations,
+        "concurrency": concurrency,
+        "latency_ms": summarize(latencies),
+        "ttft_ms": summarize(ttfts),
+        "concurrent_latency_ms": summarize([latency * 1000 for latency, _, error in outcomes if not error]),
+        "alloc_kb": {
+            "peak_mean": round(sum(peaks) / len(peaks), 1),
+            "net_mean": round(sum(nets) / len(nets), 1),
+        } if peaks else None,
+        "throughput_rps": round(completed / elapsed, 2) if elapsed else None,
+        "errors": len(errors),
+        "error_samples": sorted(set(errors))[:5],
+    }
+
+
+def run_benchmarks(args):
+    latency = profile_from_args(args)
+    api = load_lambda(latency)
+    api.JOB_PARTIAL_INTERVAL_SECONDS = args.poll_seconds
+
+    from components import lambda_client
+    from components.singleflight import request_key
+
+    server, url = start_server(api)
+    lambda_client.LAMBDA_API_URL = url
+    lambda_client.JOB_POLL_SECONDS = args.poll_seconds
+
+    scenarios = build_scenarios(api, lambda_client, request_key)
+    results = {}
+    try:
+        for name in args.scenarios:
+            print(f"Running {name}...", file=sys.stderr)
+            # The Lambda and the client print debugging output on every call
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                results[name] = measure_scenario(scenarios[name], args.iterations, args.concurrency,
+                                                 args.alloc_iterations, args.warmup)
+    finally:
+        server.shutdown()
+
+    return {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "profile": latency.as_dict(),
+        "settings": {"iterations": args.iterations, "concurrency": args.concurrency,
+                     "alloc_iterations": args.alloc_iterations, "scale": args.scale},
+        "scenarios": results,
+    }
+
+
+# ------------------------------------------------------
+# Reporting and baseline comparison
+
+def _metric(result, path):
+    value = result
+    for key in path:
+        value = (value or {}).get(key)
+    return value
+
+
+def print_report(report):
+    print(f"{'scenario':<16}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'ttft p50':>10}"
+          f"{'peak KB':>10}{'net KB':>10}{'req/s':>9}{'errors':>8}")
+    for name, result in report["scenarios"].items():
+        cells = [_metric(result, path) for path in (("latency_ms", "p50"), ("latency_ms", "p95"),
+                                                   ("latency_ms", "p99"), ("ttft_ms", "p50"),
+                                                   ("alloc_kb", "peak_mean"), ("alloc_kb", "net_mean"))]
+        print(f"{name:<16}" + "".join(f"{'-' if cell is None else cell:>10}" for cell in cells)
+              + f"{result['throughput_rps'] or '-':>9}{result['errors']:>8}")
+        for sample in result["error_samples"]:
+            print(f"    {sample}")
+
+
+def compare_reports(report, baseline, tolerance):
+    """Print the change of each compared metric and return the regressions beyond the tolerance."""
+    regressions = []
+    print(f"\nCompared with baseline from {baseline.get('created_at', 'unknown')} (tolerance {tolerance:.0%}):")
+    for name, result in report["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(name)
+        if not previous:
+            print(f"  {name}: not in baseline")
+            continue
+        for path, higher_is_better in COMPARED_METRICS.items():
+            current, before = _metric(result, path), _metric(previous, path)
+            if current is None or not before:
+                continue
+            change = (current - before) / before
+            worse = -change if higher_is_better else change
+            flag = "REGRESSION" if worse > tolerance else ""
+            print(f"  {name:<16}{'.'.join(path):<22}{before:>10} -> {current:<10}{change:+7.1%}  {flag}")
+            if flag:
+                regressions.append((name, ".".join(path), before, current))
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--iterations", type=int, default=20, help="Requests per scenario for latency and throughput")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent requests in the throughput pass")
+    parser.add_argument("--alloc-iterations", type=int, default=5, help="Requests traced with tracemalloc")
+    parser.add_argument("--warmup", type=int, default=2)
+    add_profile_arguments(parser)
+    parser.add_argument("--poll-seconds", type=float, default=0.05, help="Job poll and partial write interval")
+    parser.add_argument("--save", help="Write the results to this JSON file as a baseline")
+    parser.add_argument("--compare", help="Compare the results with a saved baseline JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Allowed relative regression per metric")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = run_benchmarks(args)
+    print_report(report)
+
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nSaved baseline to {args.save}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("profile") != report["profile"]:
+            print("\nWarning: the baseline was recorded with a different latency profile")
+        if compare_reports(report, baseline, args.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,71 @@
+"""
+Local stand-in for the API Gateway endpoint in front of the Lambda, serving
+lambda_handler over HTTP with the AWS services replaced by the benchmark fakes.
+
+Run it and point the Streamlit apps or the load generator at it:
+
+    python -m benchmarks.standin --port 8765
+    LAMBDA_API_URL=http://127.0.0.1:8765/dev/ask streamlit run tender_eval_app.py
+"""
+import argparse
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from benchmarks.fakes import add_profile_arguments, load_lambda, profile_from_args
+
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256  # Queue bursts of connections instead of refusing them
+
+
+def make_server(api, host="127.0.0.1", port=0):
+    """
+    Build a threaded HTTP server that answers every POST by calling api.lambda_handler.
+    Like the API Gateway non-proxy integration, the Lambda's return value is sent as the
+    JSON response body with status 200.
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            try:
+                event = json.loads(self.rfile.read(length) or b"{}")
+            except ValueError:
+                self._send(400, {"message": "Invalid JSON body"})
+                return
+            self._send(200, api.lambda_handler(event, None))
+
+        def _send(self, status, payload):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # Keep request logging out of benchmark output
+
+    return StandInServer((host, port), Handler)
+
+
+def start_server(api, host="127.0.0.1", port=0):
+    """Start a stand-in server on a background thread and return (server, url)."""
+    server = make_server(api, host, port)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/dev/ask"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+
+    api = load_lambda(profile_from_args(args))
+    server = make_server(api, args.host, args.port)
+    print(f"Serving lambda_handler at http://{args.host}:{args.port}/dev/ask")
+    server.serve_forever()
@@ -0,0 +1,52 @@
+import streamlit as st
+
+# Number of most recent conversation turns (user + assistant) drawn in full on every rerun
+RECENT_TURNS = 5
+# Number of older messages drawn per page once the archive is opened
+ARCHIVE_PAGE_SIZE = 20
+
+
+def _render_message(message):
+    """Draw a single chat message."""
+    with st.chat_message(message["role"]):
+        st.write(message["content"])
+
+
+def render_chat_history(messages, recent_turns=RECENT_TURNS, page_size=ARCHIVE_PAGE_SIZE, key="chat_archive"):
+    """
+    Render the latest turns in full and collapse older messages behind a paged archive.
+    Older messages are only drawn when the archive is opened, one page at a time,
+    so the cost of a rerun does not grow with the length of the conversation.
+    """
+    recent_count = recent_turns * 2
+    split_at = max(len(messages) - recent_count, 0)
+    older, recent = messages[:split_at], messages[split_at:]
+
+    if older:
+        show_older = st.checkbox(f"Show {len(older)} earlier messages", key=f"{key}_show")
+        if show_older:
+            page_count = (len(older) + page_size - 1) // page_size
+            page = 1
+            if page_count > 1:
+                # Default to the most recent page of the archive
+                page = int(st.number_input("Earlier messages page", min_value=1, max_value=page_count,
+                                           value=page_count, step=1, key=f"{key}_page"))
+            start = (page - 1) * page_size
+            for message in older[start:start + page_size]:
+                _render_message(message)
+            st.divider()
+
+    for message in recent:
+        _render_message(message)
+
+
+def render_history_log(messages, page_size=ARCHIVE_PAGE_SIZE, key="history_log"):
+    """Render the sidebar history log lazily, showing only the latest page on request."""
+    st.write("### History Logs")
+    if not messages:
+        st.write("No history available.")
+        return
+
+    st.caption(f"{len(messages)} messages in this session")
+    if st.checkbox("Show history log", key=f"{key}_show"):
+        st.json(messages[-page_size:])  # Only the latest page is serialised
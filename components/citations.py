@@ -0,0 +1,214 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+import boto3
+import streamlit as st
+from botocore.exceptions import BotoCoreError, ClientError
+from pydantic import BaseModel, ValidationError, parse_obj_as
+
+PRESIGN_EXPIRATION_SECONDS = 300
+PRESIGN_WORKERS = 16
+
+s3_client = boto3.client('s3')
+_presign_executor = ThreadPoolExecutor(max_workers=PRESIGN_WORKERS)
+
+# s3 uri -> (presigned url, time it stops being reused); links are reused for half their lifetime
+_presigned_urls = {}
+_presigned_lock = threading.Lock()
+
+
+# ------------------------------------------------------
+# Validation
+
+class Citation(BaseModel):
+    """A retrieved chunk cited for an answer. Missing location, score or page metadata is tolerated."""
+    page_content: str = ""
+    metadata: Dict[str, Any] = {}
+
+    def _attribute(self, name):
+        # Knowledge Base metadata attributes are either top-level or nested under source_metadata
+        nested = self.metadata.get("source_metadata")
+        if isinstance(nested, dict) and nested.get(name) is not None:
+            return nested[name]
+        return self.metadata.get(name)
+
+    @property
+    def uri(self) -> str:
+        location = self.metadata.get("location")
+        if not isinstance(location, dict):
+            return ""
+        return (location.get("s3Location") or {}).get("uri", "")
+
+    @property
+    def score(self) -> Optional[float]:
+        try:
+            return float(self.metadata["score"])
+        except (KeyError, TypeError, ValueError):
+            return None
+
+    @property
+    def source_uri(self) -> str:
+        """S3 uri of the uploaded document the chunk came from, or of the chunk itself."""
+        source_document = self._attribute("source_document")
+        if source_document and self.uri.startswith("s3://"):
+            bucket, _ = parse_s3_uri(self.uri)
+            return f"s3://{bucket}/{source_document}"
+        return self.uri
+
+    @property
+    def pages(self) -> Optional[tuple]:
+        try:
+            start = int(float(self._attribute("page_start")))
+        except (TypeError, ValueError):
+            return None
+        try:
+            end = int(float(self._attribute("page_end")))
+        except (TypeError, ValueError):
+            end = start
+        return start, max(start, end)
+
+
+def _as_dict(doc):
+    if isinstance(doc, dict):
+        return {"page_content": doc.get("page_content") or "", "metadata": doc.get("metadata") or {}}
+    # LangChain Document returned by the retriever in the direct-call app
+    return {"page_content": getattr(doc, "page_content", "") or "", "metadata": getattr(doc, "metadata", {}) or {}}
+
+
+def parse_citations(context) -> List[Citation]:
+    """Validate the context of an answer in one pass, dropping entries that are not citations."""
+    items = [_as_dict(doc) for doc in context or []]
+    try:
+        return parse_obj_as(List[Citation], items)
+    except ValidationError:
+        citations = []
+        for item in items:
+            try:
+                citations.append(Citation.parse_obj(item))
+            except ValidationError:
+                continue
+        return citations
+
+
+# ------------------------------------------------------
+# Grouping by source document
+
+def parse_s3_uri(uri: str) -> tuple:
+    """Parse S3 URI to extract bucket and key"""
+    parts = uri.replace("s3://", "").split("/")
+    bucket = parts[0]
+    key = "/".join(parts[1:])
+    return bucket, key
+
+
+def merge_page_ranges(ranges):
+    """Merge overlapping and adjacent (start, end) page ranges."""
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def format_pages(ranges):
+    if not ranges:
+        return ""
+    label = "page" if len(ranges) == 1 and ranges[0][0] == ranges[0][1] else "pages"
+    return f"{label} " + ", ".join(f"{start}" if start == end else f"{start}–{end}" for start, end in ranges)
+
+
+def group_citations(citations):
+    """
+    Group citations by source document, keeping retrieval order. Each group has the
+    source uri, its chunks, the merged page ranges they cover and the best score.
+    """
+    groups = {}
+    for citation in citations:
+        source = citation.source_uri or "Unknown source"
+        group = groups.setdefault(source, {"source": source, "chunks": [], "pages": [], "score": None, "url": None})
+        group["chunks"].append(citation)
+        if citation.pages:
+            group["pages"].append(citation.pages)
+        if citation.score is not None and (group["score"] is None or citation.score > group["score"]):
+            group["score"] = citation.score
+    for group in groups.values():
+        group["pages"] = merge_page_ranges(group["pages"])
+    return list(groups.values())
+
+
+# ------------------------------------------------------
+# Source links
+
+def _presign(uri):
+    bucket, key = parse_s3_uri(uri)
+    try:
+        return s3_client.generate_presigned_url('get_object', Params={'Bucket': bucket, 'Key': key},
+                                                ExpiresIn=PRESIGN_EXPIRATION_SECONDS)
+    except (BotoCoreError, ClientError):  # e.g. no AWS credentials available
+        return None
+
+
+async def _presign_all(uris):
+    loop = asyncio.get_running_loop()
+    urls = await asyncio.gather(*(loop.run_in_executor(_presign_executor, _presign, uri) for uri in uris))
+    return dict(zip(uris, urls))
+
+
+def presign_sources(uris):
+    """Return {s3 uri: presigned url or None}, presigning the uris not cached yet concurrently."""
+    now = time.time()
+    with _presigned_lock:
+        cached = {uri: entry[0] for uri, entry in _presigned_urls.items() if uri in uris and entry[1] > now}
+    missing = sorted({uri for uri in uris if uri.startswith("s3://")} - set(cached))
+    if missing:
+        resolved = asyncio.run(_presign_all(missing))
+        with _presigned_lock:
+            for uri, url in resolved.items():
+                if url:
+                    _presigned_urls[uri] = (url, now + PRESIGN_EXPIRATION_SECONDS / 2)
+        cached.update(resolved)
+    return cached
+
+
+def prepare_citations(context):
+    """Validate, group and link the citations of an answer, ready to render."""
+    groups = group_citations(parse_citations(context))
+    urls = presign_sources({group["source"] for group in groups})
+    for group in groups:
+        group["url"] = urls.get(group["source"])
+    return groups
+
+
+# ------------------------------------------------------
+# Rendering
+
+def citations_markdown(groups):
+    lines = []
+    for group in groups:
+        name = group["source"].rsplit("/", 1)[-1] or group["source"]
+        title = f"[{name}]({group['url']})" if group["url"] else f"{name} (link unavailable)"
+        details = [detail for detail in (format_pages(group["pages"]),
+                                         f"best score {group['score']:.2f}" if group["score"] is not None else "")
+                   if detail]
+        lines.append(f"**{title}**" + (f" — {', '.join(details)}" if details else ""))
+        for citation in group["chunks"]:
+            excerpt = citation.page_content.strip().replace("\n", "\n> ")
+            if not excerpt:
+                continue
+            score = f" *(score {citation.score:.2f})*" if citation.score is not None else ""
+            lines.append(f"> {excerpt}{score}")
+    return "\n\n".join(lines)
+
+
+def render_citations(context, label="Show source details >"):
+    """Show an answer's sources grouped by document in one expander, rendered in a single pass."""
+    groups = prepare_citations(context)
+    if not groups:
+        return
+    with st.expander(label):
+        st.markdown(citations_markdown(groups))
@@ -0,0 +1,169 @@
+import json
+import os
+import threading
+import time
+import requests
+
+from components.singleflight import LeaderAbandonedError, request_flights
+
+# API Gateway URL for your Lambda function; set LAMBDA_API_URL to use a local stand-in server
+LAMBDA_API_URL = os.environ.get("LAMBDA_API_URL", "https://9d859kfrp7.execute-api.us-east-1.amazonaws.com/dev/ask")
+
+# How many times a request the Lambda rejected as throttled is resent after its retry_after delay
+THROTTLE_RETRIES = 2
+
+
+def _post_once(payload, timeout):
+    headers = {
+        "Content-Type": "application/json"
+    }
+
+    response = requests.post(LAMBDA_API_URL, json=payload, headers=headers, timeout=timeout)
+    response.raise_for_status()
+
+    # Process Lambda response
+    response_data = response.json()
+    if "body" in response_data:
+        return json.loads(response_data["body"])  # Decode the JSON string in the 'body' field
+
+    return response_data
+
+
+def post_to_lambda(payload, timeout=None, retry_throttled=True):
+    """
+    POST a payload to the Lambda API and return the decoded response body.
+    Throttled requests are resent after the delay the Lambda asks for, unless
+    retry_throttled is False (job polls, whose records carry the job's own status).
+    Raises requests.exceptions.RequestException on connection or HTTP errors.
+    """
+    for attempt in range(THROTTLE_RETRIES + 1):
+        response_data = _post_once(payload, timeout)
+        if not retry_throttled or not response_data.get("retryable") or attempt == THROTTLE_RETRIES:
+            return response_data
+        time.sleep(response_data.get("retry_after", 1))
+
+
+def fetch_session_history(session_id):
+    """Return the messages stored server-side for a session."""
+    return post_to_lambda({"action": "get_history", "session_id": session_id}).get("messages", [])
+
+
+def append_session_history(session_id, messages):
+    """Append messages to a server-side session without invoking the model."""
+    return post_to_lambda({"action": "append_history", "session_id": session_id, "messages": messages})
+
+
+def fetch_usage(session_id, user_id):
+    """Return the running token usage and budgets of a session and its user."""
+    return post_to_lambda({"action": "get_usage", "session_id": session_id, "user_id": user_id})
+
+
+def post_coalesced(payload, flight_key):
+    """
+    POST a question payload, sharing one Lambda call among concurrent identical requests.
+    Callers that attached to another session's call get the turn recorded in their own session.
+    """
+    try:
+        response, shared = request_flights.do(flight_key, lambda: post_to_lambda(payload))
+    except LeaderAbandonedError:
+        # The call this request attached to was stopped; make it separately instead
+        response, shared = post_to_lambda(payload), False
+    if shared:
+        # The usage belongs to the leader's session and user; this request spent nothing
+        response = {key: value for key, value in response.items() if key != "usage"}
+    if shared and payload.get("session_id") and "response" in response:
+        append_session_history(payload["session_id"], [
+            {"role": "user", "content": payload["question"]},
+            {"role": "assistant", "content": response["response"]},
+        ])
+    return response
+
+
+# ------------------------------------------------------
+# Asynchronous jobs for long-running reports
+
+JOB_POLL_SECONDS = 1.0
+JOB_TIMEOUT_SECONDS = 900
+
+# flight key -> (job id, submitted at) of jobs submitted from this server process and not
+# yet seen finished, so identical submissions attach to the job instead of starting another
+_running_jobs = {}
+_running_jobs_lock = threading.Lock()
+
+
+def follow_job(job_id):
+    """Poll a job until it finishes, yielding each poll record; the last record carries the result."""
+    deadline = time.time() + JOB_TIMEOUT_SECONDS
+    while time.time() < deadline:
+        record = post_to_lambda({"action": "poll_job", "job_id": job_id}, retry_throttled=False)
+        if "status" not in record:
+            yield dict(record, status="failed")  # Unknown job or Lambda error
+            return
+        if record["status"] in ("succeeded", "failed"):
+            yield dict(record, **post_to_lambda({"action": "fetch_job", "job_id": job_id}, retry_throttled=False))
+            return
+        yield record
+        time.sleep(JOB_POLL_SECONDS)
+    yield {"job_id": job_id, "status": "failed", "error": "Timed out waiting for the job to finish"}
+
+
+def _forget_job(key, job_id):
+    with _running_jobs_lock:
+        if _running_jobs.get(key, (None,))[0] == job_id:
+            del _running_jobs[key]
+
+
+def submit_or_attach_job(payload, flight_key):
+    """
+    Submit a payload as an asynchronous job, or attach to the identical job already running.
+    Returns (submit response, shared); the response has a job_id unless the submit failed.
+    """
+    key = ("job",) + tuple(flight_key)
+
+    def submit():
+        with _running_jobs_lock:
+            job_id, submitted_at = _running_jobs.get(key, (None, 0.0))
+        if job_id and time.time() - submitted_at < JOB_TIMEOUT_SECONDS:
+            return {"job_id": job_id, "attached": True}
+        submitted = post_to_lambda(dict(payload, action="submit_job"))
+        if "job_id" in submitted:
+            with _running_jobs_lock:
+                _running_jobs[key] = (submitted["job_id"], time.time())
+        return submitted
+
+    # Concurrent submits share one request; later ones find the job in _running_jobs
+    try:
+        submitted, shared = request_flights.do(key, submit)
+    except LeaderAbandonedError:
+        submitted, shared = submit(), False
+    return submitted, shared or bool(submitted.get("attached"))
+
+
+def stream_job(payload, flight_key):
+    """
+    Submit a payload as an asynchronous job and yield its poll records until it finishes.
+    Identical concurrent submissions attach to the job already in flight, and each caller
+    polls the job itself, so one caller stopping does not affect the others. If the job
+    ran for another session, the finished turn is recorded in this payload's session.
+    """
+    submitted, _ = submit_or_attach_job(payload, flight_key)
+    if "job_id" not in submitted:
+        yield dict(submitted, status="failed")
+        return
+
+    session_id = payload.get("session_id")
+    record = None
+    for record in follow_job(submitted["job_id"]):
+        if record["status"] in ("succeeded", "failed"):
+            _forget_job(("job",) + tuple(flight_key), submitted["job_id"])
+            if record.get("session_id") != session_id and record.get("result"):
+                # The usage belongs to the session that submitted the job, not this one
+                record = dict(record, result={key: value for key, value in record["result"].items() if key != "usage"})
+        yield record
+
+    result = (record or {}).get("result") or {}
+    if session_id and record.get("session_id") != session_id and "response" in result:
+        append_session_history(session_id, [
+            {"role": "user", "content": payload["question"]},
+            {"role": "assistant", "content": result["response"]},
+        ])
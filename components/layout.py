@@ -3,6 +3,9 @@ import streamlit as st
 import boto3
 import os
 from botocore.exceptions import ClientError
+from datetime import datetime, timezone
+from components.report_cache import document_hash, pregenerate_report
+from components.preprocess import preprocess_and_upload, delete_processed_artifacts
 
 # Initialize the Bedrock client
 bedrock_client = boto3.client('bedrock-agent', region_name='us-east-1')
@@ -55,6 +58,7 @@ def render_sidebar():
                 return
             
             s3_client.delete_object(Bucket=bucket_name, Key=file_key)
+            delete_processed_artifacts(s3_client, bucket_name, file_key)
             st.sidebar.success(f"File '{file_key}' deleted successfully!")
             st.rerun()  # Rerun the app to reflect the changes
         except ClientError as e:
@@ -65,11 +69,28 @@ def render_sidebar():
     def upload_file(document, folder_name="eval-doc-files/"):
         """Upload the file to the S3 bucket, replacing the existing one."""
         s3_file_path = os.path.join(folder_name, document.name)  # Use original file name
+        doc_hash = document_hash(document)
+        # The uploader keeps its value across reruns, so only upload new content once
+        if st.session_state.get("uploaded_doc") == (s3_file_path, doc_hash):
+            return
+        # Taken before the upload, so ingestion jobs started by the upload or the chunk writes count
+        uploaded_at = datetime.now(timezone.utc)
         try:
             s3_client.upload_fileobj(document, bucket_name, s3_file_path)
+            # Stream the document into normalized chunks next to the original for ingestion
+            with st.spinner('Preprocessing document...'):
+                manifest = preprocess_and_upload(s3_client, bucket_name, document, s3_file_path, doc_hash)
+            st.session_state.uploaded_doc = (s3_file_path, doc_hash)
             st.sidebar.success(f"Successfully uploaded the file to `{s3_file_path}`!")
+            if manifest["preprocessed"]:
+                st.sidebar.info(f"Prepared {manifest['chunks']} chunks from {manifest['pages']} pages "
+                                f"({manifest['boilerplate_lines_removed']} boilerplate lines removed).")
+            elif manifest.get("fallback_reason"):
+                st.sidebar.info(f"Ingesting the document as uploaded: {manifest['fallback_reason']}.")
             # Trigger Bedrock sync after a successful upload
             #trigger_bedrock_sync()
+            # Pre-generate the standard evaluation report once ingestion has finished
+            pregenerate_report(s3_file_path, doc_hash, uploaded_at)
         except Exception as e:
             st.sidebar.error(f"Error: {str(e)}")
 
@@ -99,6 +120,11 @@ def render_sidebar():
             st.write("No content available for the selected evaluation document.")
             st.rerun()
 
+def get_document_scope():
+    """Return the document keys retrieval should be limited to, based on the sidebar selection."""
+    selected_eval_file = st.session_state.get("selected_eval_file")
+    return [selected_eval_file] if selected_eval_file else None
+
 # Main app logic
 def main():
     render_sidebar()
@@ -0,0 +1,330 @@
+import hashlib
+import json
+import math
+import os
+import re
+import tempfile
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import pdfplumber
+except ImportError:  # PDFs are then copied to the processed folder unchanged
+    pdfplumber = None
+
+# Normalized chunks are written here, one text object plus metadata sidecar per chunk.
+# Point the Knowledge Base data source at this prefix with no further chunking.
+PROCESSED_FOLDER = 'processed-doc-files/'
+# One manifest per source document, kept outside the Knowledge Base data source
+MANIFEST_FOLDER = 'processed-doc-manifests/'
+
+TEXT_EXTENSIONS = {'.txt', '.md', '.csv'}
+LINES_PER_TEXT_PAGE = 60  # Plain text files are streamed in pseudo-pages of this many lines
+CHUNK_TARGET_CHARS = 1500
+DUPLICATE_BLOCK_MIN_CHARS = 80  # Shorter repeated blocks (e.g. "Yes", "N/A") are kept
+EDGE_LINES = 3  # Lines at the top and bottom of each page checked for headers and footers
+BOILERPLATE_SAMPLE_PAGES = 20
+BOILERPLATE_MIN_SHARE = 0.5  # Share of sampled pages an edge line must repeat on
+BOILERPLATE_MIN_LETTERS = 4  # Shorter edge lines (e.g. "Yes", "N/A") are never treated as boilerplate
+# Below this share of the extracted text kept in chunks, the original file is ingested instead
+MIN_KEPT_TEXT_SHARE = 0.25
+UPLOAD_WORKERS = 8
+
+
+# Page numbers are the only part of a line whose digits may differ between pages
+_PAGE_NUMBER_TOKEN = re.compile(r"\bpage \d+( ?(of|/) ?\d+)?\b")
+_PAGE_NUMBER_LINE = re.compile(r"^[-–(\[ ]*\d+( ?(of|/) ?\d+)?[-–)\] ]*$")
+
+
+def _normalize_line(line):
+    """
+    Collapse whitespace and case, and fold page numbers so "Page 3 of 40" matches
+    "Page 4 of 40". Other digits are kept: numbered clauses are never the same line.
+    """
+    normalized = " ".join(line.split()).casefold()
+    if _PAGE_NUMBER_LINE.match(normalized):
+        return "page #"  # A line holding only a page number, e.g. "- 3 -" or "3 of 40"
+    return _PAGE_NUMBER_TOKEN.sub("page #", normalized)
+
+
+def _edge_indexes(lines):
+    """Indexes of the non-empty lines at the top and bottom of a page, where headers and footers sit."""
+    filled = [index for index, line in enumerate(lines) if line.strip()]
+    # On short pages only the very first and last lines can be headers or footers
+    edge_count = EDGE_LINES if len(filled) > 4 * EDGE_LINES else 1
+    return set(filled[:edge_count] + filled[-edge_count:])
+
+
+def _table_to_lines(rows):
+    return [" | ".join((cell or "").replace("\n", " ").strip() for cell in row) for row in rows if row]
+
+
+# ------------------------------------------------------
+# Page streaming
+
+def _pdf_pages(document):
+    with pdfplumber.open(document) as pdf:
+        for number, page in enumerate(pdf.pages, start=1):
+            tables = page.find_tables()
+            text_page = page
+            for table in tables:
+                # Keep table cells out of the running text so they are not extracted twice
+                text_page = text_page.outside_bbox(table.bbox, strict=False)
+            lines = (text_page.extract_text() or "").splitlines()
+            table_lines = [line for table in tables for line in _table_to_lines(table.extract())]
+            page.close()  # Release the parsed page so memory stays bounded to one page
+            yield number, lines, table_lines
+
+
+def _text_pages(document):
+    number, lines = 0, []
+    for raw_line in document:
+        lines.append(raw_line.decode("utf-8", errors="replace").rstrip("\r\n"))
+        if len(lines) == LINES_PER_TEXT_PAGE:
+            number += 1
+            yield number, lines, []
+            lines = []
+    if lines:
+        yield number + 1, lines, []
+
+
+def iter_pages(document, filename):
+    """Yield (page number, text lines, table lines) one page at a time."""
+    document.seek(0)
+    extension = os.path.splitext(filename)[1].lower()
+    if extension == '.pdf':
+        return _pdf_pages(document)
+    return _text_pages(document)
+
+
+def can_preprocess(filename):
+    extension = os.path.splitext(filename)[1].lower()
+    return extension in TEXT_EXTENSIONS or (extension == '.pdf' and pdfplumber is not None)
+
+
+# ------------------------------------------------------
+# Boilerplate detection and chunking
+
+def detect_boilerplate(document, filename):
+    """
+    Return the normalized header and footer lines that repeat across pages,
+    sampling the first pages of the document.
+    """
+    counts = Counter()
+    sampled = 0
+    for _, lines, _ in iter_pages(document, filename):
+        counts.update({_normalize_line(lines[index]) for index in _edge_indexes(lines)})
+        sampled += 1
+        if sampled == BOILERPLATE_SAMPLE_PAGES:
+            break
+    if sampled < 2:
+        return set()
+    threshold = max(2, math.ceil(sampled * BOILERPLATE_MIN_SHARE))
+    return {line for line, count in counts.items()
+            if count >= threshold and sum(char.isalpha() for char in line) >= BOILERPLATE_MIN_LETTERS}
+
+
+def _chunk_id(source_key, text, seen_ids):
+    """Content-derived id, so unchanged chunks keep their id when a document is re-uploaded."""
+    chunk_id = hashlib.sha256(f"{source_key}\n{text}".encode("utf-8")).hexdigest()[:16]
+    occurrence = 1
+    base_id = chunk_id
+    while chunk_id in seen_ids:
+        occurrence += 1
+        chunk_id = f"{base_id}-{occurrence}"
+    seen_ids.add(chunk_id)
+    return chunk_id
+
+
+def iter_chunks(document, filename, source_key, boilerplate, stats):
+    """
+    Stream chunks of normalized text with stable ids and page ranges. Header/footer lines
+    at the edges of a page and repeated blocks are dropped; counts are added to `stats`.
+    """
+    seen_blocks = set()
+    seen_ids = set()
+    buffer, buffer_chars, first_page = [], 0, None
+
+    def flush(last_page):
+        text = "\n".join(buffer)
+        return {
+            "chunk_id": _chunk_id(source_key, text, seen_ids),
+            "page_start": first_page,
+            "page_end": last_page,
+            "text": text,
+        }
+
+    for number, lines, table_lines in iter_pages(document, filename):
+        stats["pages"] += 1
+        if not any(line.strip() for line in lines + table_lines):
+            stats["pages_without_text"] += 1
+        stats["text_chars"] += sum(len(" ".join(line.split())) for line in lines + table_lines)
+
+        # Split the page into blocks of consecutive lines, tables last
+        edges = _edge_indexes(lines)
+        blocks, block = [], []
+        for index, line in enumerate(lines):
+            is_boilerplate = index in edges and _normalize_line(line) in boilerplate
+            if is_boilerplate:
+                stats["boilerplate_lines_removed"] += 1
+            if is_boilerplate or not line.strip():
+                if block:
+                    blocks.append(block)
+                    block = []
+                continue
+            block.append(" ".join(line.split()))
+        if block:
+            blocks.append(block)
+        if table_lines:
+            blocks.append(table_lines)
+
+        for block in blocks:
+            block_text = "\n".join(block)
+            if len(block_text) >= DUPLICATE_BLOCK_MIN_CHARS:
+                # Digits are kept, so numbered clauses with the same answer are not duplicates
+                digest = hashlib.sha256(" ".join(block_text.split()).casefold().encode("utf-8")).digest()
+                if digest in seen_blocks:
+                    stats["duplicate_blocks_removed"] += 1
+                    continue
+                seen_blocks.add(digest)
+
+            for line in block:
+                if first_page is None:
+                    first_page = number
+                buffer.append(line)
+                buffer_chars += len(line) + 1
+                if buffer_chars >= 2 * CHUNK_TARGET_CHARS:
+                    yield flush(number)
+                    buffer, buffer_chars, first_page = [], 0, None
+            if buffer_chars >= CHUNK_TARGET_CHARS:
+                yield flush(number)
+                buffer, buffer_chars, first_page = [], 0, None
+
+        stats["last_page"] = number
+
+    if buffer:
+        yield flush(stats["last_page"])
+
+
+# ------------------------------------------------------
+# Upload
+
+def _chunk_prefix(source_key):
+    return f"{PROCESSED_FOLDER}{os.path.basename(source_key)}/"
+
+
+def _list_keys(s3_client, bucket_name, prefix):
+    keys = set()
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+        keys.update(item['Key'] for item in page.get('Contents', []))
+    return keys
+
+
+def _delete_keys(s3_client, bucket_name, keys):
+    keys = sorted(keys)
+    for start in range(0, len(keys), 1000):
+        s3_client.delete_objects(
+            Bucket=bucket_name,
+            Delete={'Objects': [{'Key': key} for key in keys[start:start + 1000]]},
+        )
+
+
+def _metadata_sidecar(source_key, doc_hash, chunk=None):
+    attributes = {"source_document": source_key, "document_hash": doc_hash}
+    if chunk:
+        attributes.update(chunk_id=chunk["chunk_id"], page_start=chunk["page_start"], page_end=chunk["page_end"])
+    return json.dumps({"metadataAttributes": attributes})
+
+
+def _put_chunk(s3_client, bucket_name, key, chunk, source_key, doc_hash):
+    s3_client.put_object(Bucket=bucket_name, Key=key, Body=chunk["text"].encode("utf-8"),
+                         ContentType="text/plain; charset=utf-8")
+    s3_client.put_object(Bucket=bucket_name, Key=f"{key}.metadata.json",
+                         Body=_metadata_sidecar(source_key, doc_hash, chunk).encode("utf-8"),
+                         ContentType="application/json")
+
+
+def _copy_original(s3_client, bucket_name, source_key, doc_hash, prefix, stale_keys):
+    filename = os.path.basename(source_key)
+    key = f"{prefix}{filename}"
+    s3_client.copy_object(Bucket=bucket_name, Key=key, CopySource={'Bucket': bucket_name, 'Key': source_key})
+    s3_client.put_object(Bucket=bucket_name, Key=f"{key}.metadata.json",
+                         Body=_metadata_sidecar(source_key, doc_hash).encode("utf-8"))
+    _delete_keys(s3_client, bucket_name, stale_keys - {key, f"{key}.metadata.json"})
+
+
+def _fallback_reason(stats):
+    """Why the chunks of a document should not replace the original file, or None."""
+    if stats["pages_without_text"]:
+        return f"{stats['pages_without_text']} pages have no extractable text (scanned?)"
+    if not stats["chunks"] or stats["chars"] < stats["text_chars"] * MIN_KEPT_TEXT_SHARE:
+        return f"only {stats['chars']} of {stats['text_chars']} extracted characters were kept"
+    return None
+
+
+def preprocess_and_upload(s3_client, bucket_name, document, source_key, doc_hash):
+    """
+    Stream an uploaded document page by page into normalized chunks and upload them
+    under processed-doc-files/<name>/, next to the original upload in the same bucket.
+    Chunks whose content is unchanged since the last upload are not uploaded again and
+    chunks that no longer exist are deleted. Files that cannot be preprocessed, have pages
+    without extractable text, or lose most of their text are copied into the processed
+    folder unchanged, for the Knowledge Base to parse itself. Returns the manifest.
+    """
+    filename = os.path.basename(source_key)
+    prefix = _chunk_prefix(source_key)
+    existing_keys = _list_keys(s3_client, bucket_name, prefix)
+    stats = Counter(pages=0, pages_without_text=0, boilerplate_lines_removed=0,
+                    duplicate_blocks_removed=0, chunks=0, chunks_uploaded=0, chars=0, text_chars=0)
+
+    if not can_preprocess(filename):
+        _copy_original(s3_client, bucket_name, source_key, doc_hash, prefix, existing_keys)
+        manifest = {"source_document": source_key, "document_hash": doc_hash, "preprocessed": False}
+    else:
+        boilerplate = detect_boilerplate(document, filename)
+        keep_keys = set()
+        # Chunks are staged in a temporary file until the whole document has been read, so
+        # nothing reaches the data source prefix if the original file is ingested instead
+        with tempfile.TemporaryFile(mode="w+", encoding="utf-8") as staged:
+            for chunk in iter_chunks(document, filename, source_key, boilerplate, stats):
+                stats["chunks"] += 1
+                stats["chars"] += len(chunk["text"])
+                staged.write(json.dumps(chunk) + "\n")
+            stats.pop("last_page", None)
+            fallback_reason = _fallback_reason(stats)
+            if not fallback_reason:
+                staged.seek(0)
+                with ThreadPoolExecutor(max_workers=UPLOAD_WORKERS) as pool:
+                    pending = []
+                    for line in staged:
+                        chunk = json.loads(line)
+                        key = f"{prefix}{chunk['chunk_id']}.txt"
+                        keep_keys.update({key, f"{key}.metadata.json"})
+                        if key in existing_keys:
+                            continue
+                        stats["chunks_uploaded"] += 1
+                        pending.append(pool.submit(_put_chunk, s3_client, bucket_name, key, chunk, source_key, doc_hash))
+                        # Bound the number of chunks held in memory waiting for upload
+                        while len(pending) >= UPLOAD_WORKERS * 4:
+                            pending.pop(0).result()
+                    for future in pending:
+                        future.result()
+        if fallback_reason:
+            print(f"Ingesting {source_key} unprocessed: {fallback_reason}")
+            _copy_original(s3_client, bucket_name, source_key, doc_hash, prefix, existing_keys)
+        else:
+            _delete_keys(s3_client, bucket_name, existing_keys - keep_keys)
+        manifest = {"source_document": source_key, "document_hash": doc_hash, "preprocessed": not fallback_reason,
+                    "fallback_reason": fallback_reason, "boilerplate_patterns": len(boilerplate), **stats}
+
+    s3_client.put_object(Bucket=bucket_name, Key=f"{MANIFEST_FOLDER}{filename}.json",
+                         Body=json.dumps(manifest).encode("utf-8"), ContentType="application/json")
+    return manifest
+
+
+def delete_processed_artifacts(s3_client, bucket_name, source_key):
+    """Delete the processed chunks and manifest of a source document."""
+    keys = _list_keys(s3_client, bucket_name, _chunk_prefix(source_key))
+    keys.add(f"{MANIFEST_FOLDER}{os.path.basename(source_key)}.json")
+    _delete_keys(s3_client, bucket_name, keys)
@@ -0,0 +1,199 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+import boto3
+from botocore.exceptions import ClientError
+from requests.exceptions import RequestException
+
+from components.lambda_client import stream_job
+from components.singleflight import request_key
+
+# Question sent by the "Evaluate and Summarise Tenderer Documents" button
+STANDARD_REPORT_QUESTION = "Generate a review and evaluation report of the Tenderer's proposal."
+
+bucket_name = 'tender-eval-bucket'
+criteria_key = 'prompt-files/evaluation_criteria.txt'
+
+# Local directory holding pre-generated reports and the document -> hash index
+CACHE_DIR = os.environ.get("REPORT_CACHE_DIR", ".report_cache")
+
+# How long a looked-up criteria version is reused before checking S3 again
+CRITERIA_VERSION_TTL_SECONDS = 60
+
+# How long to wait for the Knowledge Base ingestion job before giving up on pre-generation
+INGESTION_TIMEOUT_SECONDS = 900
+INGESTION_POLL_SECONDS = 10
+
+s3_client = boto3.client('s3')
+bedrock_agent_client = boto3.client('bedrock-agent', region_name='us-east-1')
+
+_index_lock = threading.Lock()
+_criteria_version = {"value": None, "checked_at": 0.0}
+_in_flight = set()
+_in_flight_lock = threading.Lock()
+
+
+def document_hash(document) -> str:
+    """Return the SHA-256 of an uploaded file object, leaving it rewound for upload."""
+    digest = hashlib.sha256()
+    document.seek(0)
+    for block in iter(lambda: document.read(1024 * 1024), b""):
+        digest.update(block)
+    document.seek(0)
+    return digest.hexdigest()
+
+
+def criteria_version() -> str:
+    """Return the version of the evaluation criteria file, taken from its S3 ETag."""
+    if time.time() - _criteria_version["checked_at"] < CRITERIA_VERSION_TTL_SECONDS:
+        return _criteria_version["value"]
+    try:
+        response = s3_client.head_object(Bucket=bucket_name, Key=criteria_key)
+        version = response['ETag'].strip('"')
+    except ClientError as e:
+        print(f"Error reading evaluation criteria version: {e.response['Error']['Message']}")
+        return "unknown"
+    _criteria_version.update(value=version, checked_at=time.time())
+    return version
+
+
+# ------------------------------------------------------
+# Local report store
+
+def _report_path(doc_hash, version):
+    return os.path.join(CACHE_DIR, f"{doc_hash}-{version}.json")
+
+
+def _index_path():
+    return os.path.join(CACHE_DIR, "documents.json")
+
+
+def _write_json(path, data):
+    """Write JSON atomically so readers never see a partial file."""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path, default=None):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+def remember_document(document_key, doc_hash):
+    """Record which content hash an S3 document key currently holds."""
+    with _index_lock:
+        index = _read_json(_index_path(), {})
+        index[document_key] = doc_hash
+        _write_json(_index_path(), index)
+
+
+def store_report(doc_hash, version, report):
+    """Persist a generated report keyed by document hash and criteria version."""
+    _write_json(_report_path(doc_hash, version), report)
+
+
+def get_cached_report(document_key):
+    """Return the pre-generated report for a document key, or None if it is not ready."""
+    if not document_key:
+        return None
+    doc_hash = _read_json(_index_path(), {}).get(document_key)
+    if not doc_hash:
+        return None
+    return _read_json(_report_path(doc_hash, criteria_version()))
+
+
+# ------------------------------------------------------
+# Background pre-generation
+
+def wait_for_ingestion(started_after):
+    """
+    Wait for a Knowledge Base ingestion job covering the upload to finish: one started after
+    `started_after`, or one that was still running then (it finished or updated afterwards).
+    Returns False when completion cannot be confirmed, including when the Knowledge Base
+    is not configured in the environment, so no report is generated without its context.
+    """
+    knowledge_base_id = os.environ.get('KNOWLEDGEBASEID')
+    data_source_id = os.environ.get('DATASOURCEID')
+    if not knowledge_base_id or not data_source_id:
+        print("KNOWLEDGEBASEID and DATASOURCEID are not set; cannot confirm ingestion")
+        return False
+
+    deadline = time.time() + INGESTION_TIMEOUT_SECONDS
+    while time.time() < deadline:
+        try:
+            response = bedrock_agent_client.list_ingestion_jobs(
+                knowledgeBaseId=knowledge_base_id,
+                dataSourceId=data_source_id,
+                sortBy={'attribute': 'STARTED_AT', 'order': 'DESCENDING'},
+                maxResults=5,
+            )
+        except ClientError as e:
+            print(f"Error checking ingestion status: {e.response['Error']['Message']}")
+            return False
+        # Most recently started job that was not already finished when the upload began
+        job = next((job for job in response.get('ingestionJobSummaries', [])
+                    if job['startedAt'] >= started_after or job['updatedAt'] >= started_after), None)
+        if job is not None:
+            if job['status'] == 'COMPLETE':
+                return True
+            if job['status'] in ('FAILED', 'STOPPED'):
+                return False
+        time.sleep(INGESTION_POLL_SECONDS)
+    return False
+
+
+def _pregenerate(document_key, doc_hash, uploaded_at):
+    try:
+        if not wait_for_ingestion(uploaded_at):
+            print(f"Skipping report pre-generation for {doc_hash}: ingestion did not complete")
+            return
+        version = criteria_version()
+        if os.path.exists(_report_path(doc_hash, version)):
+            return
+        # Runs as an asynchronous job, shared with an evaluator pressing the button meanwhile
+        record = None
+        for record in stream_job({
+            "question": STANDARD_REPORT_QUESTION,
+            "priority": "background",  # Yield to interactive chat when Bedrock is busy
+            "documents": [document_key],  # Report on this document's chunks only
+        }, request_key(STANDARD_REPORT_QUESTION, version, documents=[document_key])):
+            pass
+        report = (record or {}).get("result") or {}
+        if "response" in report and not report.get("context"):
+            # Nothing retrieved for the document yet; caching this would serve an empty report
+            print(f"Not caching report for {doc_hash}: no context was retrieved")
+        elif "response" in report:
+            store_report(doc_hash, version, report)
+        else:
+            print(f"Report pre-generation failed for {doc_hash}: {(record or {}).get('error')}")
+    except (RequestException, RuntimeError) as e:
+        print(f"Error pre-generating report for {doc_hash}: {e}")
+    finally:
+        with _in_flight_lock:
+            _in_flight.discard(doc_hash)
+
+
+def pregenerate_report(document_key, doc_hash, uploaded_at):
+    """
+    Start generating the standard evaluation report for a newly uploaded document
+    in a background thread, once ingestion of the upload started at `uploaded_at`
+    (an aware UTC datetime taken before the S3 upload) has finished.
+    Does nothing if a report is already cached or in progress.
+    """
+    remember_document(document_key, doc_hash)
+    if os.path.exists(_report_path(doc_hash, criteria_version())):
+        return
+    with _in_flight_lock:
+        if doc_hash in _in_flight:
+            return
+        _in_flight.add(doc_hash)
+    threading.Thread(target=_pregenerate, args=(document_key, doc_hash, uploaded_at), daemon=True).start()
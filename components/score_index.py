@@ -0,0 +1,165 @@
+import bisect
+import os
+import re
+import sqlite3
+import threading
+import time
+
+# Local SQLite file the per-criterion scores are persisted in
+SCORE_INDEX_PATH = os.environ.get("SCORE_INDEX_PATH", ".score_index.db")
+
+# Words that mark a chat question as a ranking/comparison question over the index
+_RANKING_WORDS = re.compile(r"\b(best|highest|top|rank|ranking|ranked|lowest|worst|compare|comparison)\b", re.IGNORECASE)
+# The question must also be explicitly about tenderers, e.g. "which tenderer scored best on
+# safety?" or "rank the tenderers on price", not about the content of one document
+_CROSS_TENDERER_WORDS = re.compile(
+    r"\b(which|who)\b.*\b(tenderers?|bidders?|suppliers?|scored?|ranks?|ranked)\b"
+    r"|\b(rank|ranking|compare|comparison)\b.*\b(tenderers|bidders|suppliers)\b",
+    re.IGNORECASE | re.DOTALL,
+)
+_LOWEST_WORDS = re.compile(r"\b(lowest|worst)\b", re.IGNORECASE)
+
+
+def _criterion_key(criterion):
+    return " ".join(criterion.split()).casefold()
+
+
+class ScoreIndex:
+    """
+    Structured per-criterion scores for each tenderer, persisted in SQLite and held
+    in memory for ranking, filtering and comparison without calling the model.
+    """
+
+    def __init__(self, path=SCORE_INDEX_PATH):
+        self.path = path
+        self._lock = threading.RLock()  # upsert mutates the dicts the readers iterate
+        with self._connect() as conn:
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(scores)")]
+            old_rows = []
+            if columns and "criterion_key" not in columns:
+                # Tables from before criteria were keyed case-insensitively; re-key their rows
+                old_rows = conn.execute(
+                    "SELECT tenderer, criterion, score, max_score, evidence, criteria_version, updated_at "
+                    "FROM scores ORDER BY updated_at"
+                ).fetchall()
+                conn.execute("DROP TABLE scores")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS scores ("
+                "tenderer TEXT NOT NULL, criterion_key TEXT NOT NULL, criterion TEXT NOT NULL, "
+                "score REAL NOT NULL, max_score REAL, evidence TEXT, criteria_version TEXT, "
+                "updated_at REAL NOT NULL, PRIMARY KEY (tenderer, criterion_key))"
+            )
+            conn.executemany("INSERT OR REPLACE INTO scores VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                             [(row[0], _criterion_key(row[1])) + tuple(row[1:]) for row in old_rows])
+        self._load()
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _load(self):
+        # criterion key -> ascending list of (score, tenderer); tenderer -> criterion key -> record
+        self._by_criterion = {}
+        self._by_tenderer = {}
+        self._criterion_names = {}
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT tenderer, criterion, score, max_score, evidence, criteria_version FROM scores"
+            ).fetchall()
+        for tenderer, criterion, score, max_score, evidence, criteria_version in rows:
+            self._add(tenderer, {"criterion": criterion, "score": score, "max_score": max_score,
+                                 "evidence": evidence, "criteria_version": criteria_version})
+
+    def _add(self, tenderer, record):
+        key = _criterion_key(record["criterion"])
+        self._criterion_names.setdefault(key, record["criterion"])
+        self._by_tenderer.setdefault(tenderer, {})[key] = record
+        bisect.insort(self._by_criterion.setdefault(key, []), (record["score"], tenderer))
+
+    def upsert(self, tenderer, scores, criteria_version=None):
+        """
+        Replace a tenderer's scores with the records from a scoring run. When the run scored
+        a criterion more than once (possibly with different case), the last record is kept.
+        """
+        now = time.time()
+        scores = list({_criterion_key(record["criterion"]): record for record in scores}.values())
+        with self._lock:
+            with self._connect() as conn:
+                conn.execute("DELETE FROM scores WHERE tenderer = ?", (tenderer,))
+                conn.executemany(
+                    "INSERT OR REPLACE INTO scores VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    [(tenderer, _criterion_key(record["criterion"]), record["criterion"], record["score"],
+                      record.get("max_score"), record.get("evidence", ""), criteria_version, now)
+                     for record in scores],
+                )
+            for key in self._by_tenderer.pop(tenderer, {}):
+                self._by_criterion[key] = [entry for entry in self._by_criterion[key] if entry[1] != tenderer]
+            for record in scores:
+                self._add(tenderer, dict(record, criteria_version=criteria_version))
+
+    def criteria(self):
+        with self._lock:
+            return [self._criterion_names[key] for key in sorted(self._criterion_names)]
+
+    def tenderers(self):
+        with self._lock:
+            return sorted(self._by_tenderer)
+
+    def rank(self, criterion, limit=None, lowest_first=False):
+        """Return [(tenderer, record)] for a criterion, best score first."""
+        key = _criterion_key(criterion)
+        with self._lock:
+            entries = self._by_criterion.get(key, [])
+            ordered = entries if lowest_first else reversed(entries)
+            ranked = [(tenderer, self._by_tenderer[tenderer][key]) for _, tenderer in ordered]
+        return ranked[:limit] if limit else ranked
+
+    def filter(self, criterion, min_score=None, max_score=None):
+        """Return the tenderers whose score on a criterion lies within the bounds, best first."""
+        return [(tenderer, record) for tenderer, record in self.rank(criterion)
+                if (min_score is None or record["score"] >= min_score)
+                and (max_score is None or record["score"] <= max_score)]
+
+    def compare(self, tenderers):
+        """Return {criterion: {tenderer: score}} for the given tenderers."""
+        with self._lock:
+            return {
+                self._criterion_names[key]: {
+                    tenderer: self._by_tenderer.get(tenderer, {}).get(key, {}).get("score") for tenderer in tenderers
+                }
+                for key in sorted(self._criterion_names)
+            }
+
+    def answer(self, question):
+        """
+        Answer a ranking question across tenderers such as "which tenderer scored best on
+        safety?" from the index. Returns None for any other question, including questions
+        that only mention a criterion, so they go to the model.
+        """
+        if not _RANKING_WORDS.search(question) or not _CROSS_TENDERER_WORDS.search(question):
+            return None
+        normalized = _criterion_key(question)
+        with self._lock:
+            names = dict(self._criterion_names)
+        matches = [key for key in names if re.search(rf"\b{re.escape(key)}\b", normalized)]
+        if not matches:
+            return None
+        key = max(matches, key=len)  # Prefer the most specific criterion name
+        ranked = self.rank(key, lowest_first=bool(_LOWEST_WORDS.search(question)))
+        lines = [f"Ranking on **{names[key]}** (from stored scores):"]
+        for position, (tenderer, record) in enumerate(ranked, start=1):
+            out_of = f"/{record['max_score']:g}" if record.get("max_score") else ""
+            lines.append(f"{position}. {tenderer}: {record['score']:g}{out_of} - {record.get('evidence', '')}")
+        return "\n".join(lines)
+
+
+_score_index = None
+_score_index_lock = threading.Lock()
+
+
+def get_score_index():
+    """Return the score index shared by every Streamlit session in this server process."""
+    global _score_index
+    with _score_index_lock:
+        if _score_index is None:
+            _score_index = ScoreIndex()
+        return _score_index
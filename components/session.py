@@ -0,0 +1,36 @@
+import uuid
+import streamlit as st
+
+
+def get_session_id():
+    """
+    Return the conversation session id for this browser session.
+    A session can be resumed from any app instance by opening the app with ?session=<id>.
+    """
+    if "session_id" not in st.session_state:
+        resumed_id = st.experimental_get_query_params().get("session", [None])[0]
+        session_id = resumed_id or uuid.uuid4().hex
+        st.session_state.session_id = session_id
+        st.session_state.session_resumed = bool(resumed_id)
+        st.experimental_set_query_params(session=session_id)
+    return st.session_state.session_id
+
+
+def new_session_id():
+    """Start a new server-side conversation, leaving the previous one stored."""
+    st.session_state.session_id = uuid.uuid4().hex
+    st.session_state.session_resumed = False
+    st.experimental_set_query_params(session=st.session_state.session_id)
+    return st.session_state.session_id
+
+
+def get_user_id():
+    """
+    Return the signed-in user's email where the deployment provides one, otherwise None.
+    Without an identity no per-user budget applies; a shared fallback id would put every
+    anonymous user on one budget.
+    """
+    try:
+        return st.experimental_user.email or None
+    except (AttributeError, KeyError):
+        return None
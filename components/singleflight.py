@@ -0,0 +1,136 @@
+import hashlib
+import json
+import threading
+
+# How long a follower waits without a new chunk or result before giving up on the leader
+FOLLOWER_TIMEOUT_SECONDS = 900
+
+
+def request_key(question, criteria_version, documents=None, history=None):
+    """
+    Build the coalescing key for a question: the normalized question text, the criteria
+    version, the document scope and a digest of the conversation history it depends on.
+    """
+    normalized_question = " ".join(str(question).split()).casefold()
+    history_rows = [[msg["role"], msg["content"]] for msg in (history or [])]
+    history_digest = hashlib.sha256(json.dumps(history_rows).encode("utf-8")).hexdigest()
+    return (normalized_question, criteria_version, tuple(sorted(documents or [])), history_digest)
+
+
+class LeaderAbandonedError(RuntimeError):
+    """Raised in followers when the leader's call stopped before producing a result."""
+
+
+def _shared_error(e):
+    # Ordinary exceptions are re-raised in followers; GeneratorExit, KeyboardInterrupt and
+    # the like belong to the leader's thread and are replaced with LeaderAbandonedError
+    if isinstance(e, Exception):
+        return e
+    return LeaderAbandonedError("Coalesced call was abandoned by its leader")
+
+
+def _wait(call, predicate):
+    if not call.condition.wait_for(predicate, timeout=FOLLOWER_TIMEOUT_SECONDS):
+        raise LeaderAbandonedError("Timed out waiting for the coalesced call's leader")
+
+
+class _Call:
+    """State of one in-flight call shared by its leader and followers."""
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.done = False
+        self.result = None
+        self.error = None
+        self.chunks = []
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls with the same key into a single execution.
+    The first caller (the leader) runs the work; callers arriving while it is in
+    flight attach to it and receive the same result, or the same stream of chunks.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def _join(self, key):
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                return call, False
+            call = self._calls[key] = _Call()
+            return call, True
+
+    def _finish(self, key, call, result=None, error=None):
+        with self._lock:
+            self._calls.pop(key, None)
+        with call.condition:
+            call.result, call.error, call.done = result, error, True
+            call.condition.notify_all()
+
+    def do(self, key, fn):
+        """Run fn once for all concurrent callers with this key. Returns (result, shared)."""
+        call, leader = self._join(key)
+        if not leader:
+            with call.condition:
+                _wait(call, lambda: call.done)
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            result = fn()
+        except BaseException as e:
+            self._finish(key, call, error=_shared_error(e))
+            raise
+        self._finish(key, call, result=result)
+        return result, False
+
+    def stream(self, key, fn):
+        """
+        Iterate the chunks produced by fn() once for all concurrent callers with this key.
+        Followers replay the chunks already produced and then follow the live stream.
+        """
+        call, leader = self._join(key)
+        if leader:
+            yield from self._lead_stream(key, call, fn)
+        else:
+            yield from self._follow_stream(call)
+
+    def _lead_stream(self, key, call, fn):
+        error = LeaderAbandonedError("Coalesced stream was abandoned by its leader")
+        try:
+            for chunk in fn():
+                with call.condition:
+                    call.chunks.append(chunk)
+                    call.condition.notify_all()
+                yield chunk
+            error = None
+        except BaseException as e:
+            error = _shared_error(e)
+            raise
+        finally:
+            self._finish(key, call, error=error)
+
+    def _follow_stream(self, call):
+        position = 0
+        while True:
+            with call.condition:
+                _wait(call, lambda: call.done or len(call.chunks) > position)
+                chunks = call.chunks[position:]
+                finished = call.done
+                error = call.error
+            for chunk in chunks:
+                yield chunk
+            position += len(chunks)
+            if finished:
+                if error is not None:
+                    raise error
+                return
+
+
+# Shared by every Streamlit session in this server process
+request_flights = SingleFlight()
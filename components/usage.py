@@ -0,0 +1,38 @@
+import requests
+import streamlit as st
+
+from components.lambda_client import fetch_usage
+from components.session import get_session_id, get_user_id
+
+
+def remember_usage(response):
+    """Keep the running usage totals returned with a Lambda response for the sidebar."""
+    usage = (response or {}).get("usage")
+    if usage and usage.get("totals"):
+        st.session_state.usage_totals = usage["totals"]
+        if usage.get("degraded"):
+            st.info("This conversation is close to its token budget, so earlier messages were left out "
+                    "or a smaller model was used.")
+
+
+def _render_scope(label, totals):
+    tokens = totals["input_tokens"] + totals["output_tokens"]
+    st.write(f"**{label}:** {tokens:,} tokens, ${totals['cost']:.4f} over {totals['requests']} requests")
+    if totals.get("budget"):
+        st.progress(min(1.0, tokens / totals["budget"]))
+
+
+def render_usage_sidebar():
+    """Show the session's and the user's running token usage and cost in the sidebar."""
+    if "usage_totals" not in st.session_state:
+        try:
+            st.session_state.usage_totals = fetch_usage(get_session_id(), get_user_id())
+        except requests.exceptions.RequestException:
+            return
+    totals = st.session_state.usage_totals
+    with st.sidebar:
+        st.write("### Usage")
+        if totals.get("session"):
+            _render_scope("This conversation", totals["session"])
+        if totals.get("user"):
+            _render_scope("You today", totals["user"])
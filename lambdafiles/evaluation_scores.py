@@ -0,0 +1,52 @@
+import json
+
+# Question used to retrieve the evidence a scoring run is based on
+SCORES_QUESTION = "Score the Tenderer's proposal against each evaluation criterion, citing evidence."
+
+# Output contract appended to the system prompt in scores mode
+SCORES_INSTRUCTIONS = """
+Score the Tenderer's proposal against every evaluation criterion above.
+Respond with one JSON object per line and nothing else, one line per criterion, in this form:
+{"criterion": "<criterion name>", "score": <number>, "max_score": <number>, "evidence": "<short quote or summary from the context>"}
+"""
+
+
+def parse_score(line):
+    """Parse one line of model output into a score record, or None if it is not one."""
+    line = line.strip().rstrip(",")
+    if not line.startswith("{"):
+        return None
+    try:
+        record = json.loads(line)
+        return {
+            "criterion": str(record["criterion"]).strip(),
+            "score": float(record["score"]),
+            "max_score": float(record["max_score"]) if record.get("max_score") is not None else None,
+            "evidence": str(record.get("evidence", "")).strip(),
+        }
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+class ScoreStreamParser:
+    """Incrementally parse streamed model output into score records as each line completes."""
+
+    def __init__(self):
+        self._pending = ""
+        self.scores = []
+
+    def feed(self, text):
+        """Add a chunk of streamed text and return the records completed by it."""
+        self._pending += text
+        *lines, self._pending = self._pending.split("\n")
+        return self._collect(lines)
+
+    def close(self):
+        """Parse whatever is left once the stream has ended."""
+        lines, self._pending = [self._pending], ""
+        return self._collect(lines)
+
+    def _collect(self, lines):
+        completed = [record for record in map(parse_score, lines) if record]
+        self.scores.extend(completed)
+        return completed
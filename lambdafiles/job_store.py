@@ -0,0 +1,90 @@
+import json
+import os
+import threading
+import time
+
+import boto3
+from botocore.exceptions import ClientError
+
+# Job states; a job is finished once it has succeeded or failed
+QUEUED, RUNNING, SUCCEEDED, FAILED = "queued", "running", "succeeded", "failed"
+FINISHED_STATES = {SUCCEEDED, FAILED}
+
+
+def new_job_record(job_id, request):
+    now = time.time()
+    return {
+        "job_id": job_id,
+        "status": QUEUED,
+        "request": request,
+        "session_id": request.get("session_id"),
+        "partial_response": "",
+        "partial_scores": [],
+        "partial_items": [],
+        "result": None,
+        "error": None,
+        "created_at": now,
+        "updated_at": now,
+    }
+
+
+class S3JobStore:
+    """Job records stored as JSON objects under a prefix of the evaluation bucket."""
+
+    def __init__(self, bucket_name, prefix="job-results/"):
+        self.s3_client = boto3.client('s3')
+        self.bucket_name = bucket_name
+        self.prefix = prefix
+
+    def _key(self, job_id):
+        return f"{self.prefix}{job_id}.json"
+
+    def get(self, job_id):
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket_name, Key=self._key(job_id))
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+                return None
+            raise
+        return json.loads(response['Body'].read().decode('utf-8'))
+
+    def put(self, record):
+        record["updated_at"] = time.time()
+        self.s3_client.put_object(Bucket=self.bucket_name, Key=self._key(record["job_id"]),
+                                  Body=json.dumps(record).encode('utf-8'), ContentType='application/json')
+
+
+class LocalJobStore:
+    """Job records stored as JSON files in a local directory, used for local runs and tests."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, job_id):
+        return os.path.join(self.directory, f"{job_id}.json")
+
+    def get(self, job_id):
+        try:
+            with open(self._path(job_id), encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def put(self, record):
+        record["updated_at"] = time.time()
+        tmp_path = f"{self._path(record['job_id'])}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding='utf-8') as f:
+            json.dump(record, f)
+        os.replace(tmp_path, self._path(record["job_id"]))
+
+
+def get_job_store(bucket_name):
+    """
+    Return the configured job store: a local directory when JOB_STORE_DIR is set,
+    otherwise S3 under job-results/ in the evaluation bucket.
+    """
+    directory = os.environ.get('JOB_STORE_DIR')
+    if directory:
+        return LocalJobStore(directory)
+    return S3JobStore(bucket_name)
@@ -0,0 +1,192 @@
+import heapq
+import itertools
+import json
+import random
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+# Priority classes, lower value is admitted first: interactive chat goes ahead of
+# batch checklists, which go ahead of background report pre-generation. The order only
+# holds among calls in one process (local runs, or the concurrent items of one batch
+# invocation); in Lambda each instance serves one request, so priority across requests
+# is enforced by running batch and background jobs in their own function.
+PRIORITIES = {"interactive": 0, "batch": 1, "background": 2}
+
+# Error codes Bedrock and the Knowledge Base Retrieve API use when a quota is exceeded
+THROTTLING_ERROR_CODES = {
+    "ThrottlingException",
+    "TooManyRequestsException",
+    "ServiceQuotaExceededException",
+    "ModelNotReadyException",
+}
+
+# Concurrency slots only interactive calls in the same process may use
+RESERVED_INTERACTIVE_SLOTS = 1
+
+METRICS_NAMESPACE = "TenderEval/RateGovernor"
+
+
+class ThrottledError(Exception):
+    """Raised when a call is still throttled after all retries."""
+
+    def __init__(self, resource, retry_after):
+        super().__init__(f"{resource} is throttled, retry in {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+def is_throttling_error(error):
+    """Return True if an exception is a Bedrock throttling error."""
+    if isinstance(error, ClientError):
+        return error.response.get("Error", {}).get("Code") in THROTTLING_ERROR_CODES
+    # ChatBedrock re-raises service errors as ValueError with the error code in the message
+    return any(code in str(error) for code in THROTTLING_ERROR_CODES)
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled at `rate` tokens per second up to `capacity`."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount=1):
+        """Take `amount` tokens, sleeping until they are available."""
+        amount = min(amount, self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                wait = (amount - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class AIMDLimiter:
+    """Additive-increase / multiplicative-decrease limit on concurrent calls."""
+
+    def __init__(self, initial, minimum=1, maximum=16, backoff_ratio=0.5):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.backoff_ratio = backoff_ratio
+
+    def on_success(self):
+        self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+
+    def on_throttle(self):
+        self.limit = max(self.minimum, self.limit * self.backoff_ratio)
+
+
+class RateGovernor:
+    """
+    Admission control for one rate-limited resource (the model or the retriever).
+    Calls wait in a priority queue for a concurrency slot from the AIMD limiter and
+    for request/token budget from the token buckets, and throttled calls are retried
+    with exponential backoff and jitter. All of this state is per process: the limits
+    are a per-instance share of the quota and the AIMD limit restarts on a cold start.
+    """
+
+    def __init__(self, resource, requests_per_minute, tokens_per_minute=None,
+                 initial_concurrency=4, max_concurrency=16, max_attempts=4, base_backoff=0.5, max_backoff=8.0):
+        self.resource = resource
+        self.request_bucket = TokenBucket(requests_per_minute / 60.0, max(1.0, requests_per_minute / 60.0))
+        self.token_bucket = TokenBucket(tokens_per_minute / 60.0, tokens_per_minute / 6.0) if tokens_per_minute else None
+        self.limiter = AIMDLimiter(initial_concurrency, maximum=max_concurrency)
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self._condition = threading.Condition()
+        self._queue = []
+        self._sequence = itertools.count()
+        self._in_flight = 0
+
+    def _slots_for(self, rank):
+        limit = int(self.limiter.limit)
+        if rank == PRIORITIES["interactive"]:
+            return limit
+        return max(1, limit - RESERVED_INTERACTIVE_SLOTS)
+
+    def _acquire_slot(self, priority):
+        rank = PRIORITIES.get(priority, PRIORITIES["interactive"])
+        entry = (rank, next(self._sequence))
+        with self._condition:
+            heapq.heappush(self._queue, entry)
+            queue_depth = len(self._queue)
+            self._condition.wait_for(lambda: self._queue[0] == entry and self._in_flight < self._slots_for(rank))
+            heapq.heappop(self._queue)
+            self._in_flight += 1
+            self._condition.notify_all()
+        return queue_depth
+
+    def _release_slot(self, throttled):
+        with self._condition:
+            self._in_flight -= 1
+            if throttled:
+                self.limiter.on_throttle()
+            else:
+                self.limiter.on_success()
+            self._condition.notify_all()
+
+    def call(self, fn, *args, priority="interactive", tokens=0, **kwargs):
+        """Run fn(*args, **kwargs) under the governor's limits, retrying on throttling."""
+        retries = 0
+        wait_seconds = 0.0
+        queue_depth = 0
+        try:
+            for attempt in range(self.max_attempts):
+                started = time.monotonic()
+                queue_depth = max(queue_depth, self._acquire_slot(priority))
+                self.request_bucket.acquire()
+                if self.token_bucket and tokens:
+                    self.token_bucket.acquire(tokens)
+                wait_seconds += time.monotonic() - started
+
+                throttled = False
+                try:
+                    return fn(*args, **kwargs)
+                except Exception as e:
+                    throttled = is_throttling_error(e)
+                    if not throttled:
+                        raise
+                finally:
+                    self._release_slot(throttled)
+
+                backoff = min(self.max_backoff, self.base_backoff * (2 ** attempt))
+                if attempt + 1 == self.max_attempts:
+                    raise ThrottledError(self.resource, backoff)
+                retries += 1
+                time.sleep(random.uniform(0, backoff))
+        finally:
+            self._emit_metrics(priority, queue_depth, wait_seconds, retries)
+
+    def _emit_metrics(self, priority, queue_depth, wait_seconds, retries):
+        """Print the call's metrics in CloudWatch Embedded Metric Format."""
+        print(json.dumps({
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [{
+                    "Namespace": METRICS_NAMESPACE,
+                    "Dimensions": [["Resource", "Priority"]],
+                    "Metrics": [
+                        {"Name": "QueueDepth", "Unit": "Count"},
+                        {"Name": "QueueWaitMs", "Unit": "Milliseconds"},
+                        {"Name": "Retries", "Unit": "Count"},
+                        {"Name": "ConcurrencyLimit", "Unit": "Count"},
+                    ],
+                }],
+            },
+            "Resource": self.resource,
+            "Priority": priority,
+            "QueueDepth": queue_depth,
+            "QueueWaitMs": round(wait_seconds * 1000, 1),
+            "Retries": retries,
+            "ConcurrencyLimit": round(self.limiter.limit, 2),
+        }))
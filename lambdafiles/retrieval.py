@@ -0,0 +1,35 @@
+import os
+
+from langchain_aws import AmazonKnowledgeBasesRetriever
+
+# Retrieval settings, chosen with benchmarks/retrieval_eval.py: chunks per retrieval and
+# search type (SEMANTIC or HYBRID; unset uses the knowledge base default)
+RETRIEVAL_K = int(os.environ.get('RETRIEVAL_K', 4))
+RETRIEVAL_SEARCH_TYPE = os.environ.get('RETRIEVAL_SEARCH_TYPE')
+
+
+def build_retrieval_filter(documents, bucket_name):
+    """
+    Build a Knowledge Base metadata filter matching chunks of the given source documents,
+    whether they were ingested as preprocessed chunks or as the uploaded files.
+    """
+    return {
+        "orAll": [
+            {"in": {"key": "source_document", "value": list(documents)}},
+            {"in": {"key": "x-amz-bedrock-kb-source-uri", "value": [f"s3://{bucket_name}/{doc}" for doc in documents]}},
+        ]
+    }
+
+
+def make_retriever(knowledge_base_id, client, bucket_name, documents=(), k=RETRIEVAL_K, search_type=RETRIEVAL_SEARCH_TYPE):
+    """Return a retriever scoped to the given document keys, or the whole knowledge base."""
+    vector_search_config = {"numberOfResults": k}
+    if search_type:
+        vector_search_config["overrideSearchType"] = search_type
+    if documents:
+        vector_search_config["filter"] = build_retrieval_filter(documents, bucket_name)
+    return AmazonKnowledgeBasesRetriever(
+        knowledge_base_id=knowledge_base_id,
+        retrieval_config={"vectorSearchConfiguration": vector_search_config},
+        client=client,
+    )
@@ -0,0 +1,155 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+import boto3
+from botocore.exceptions import ClientError
+
+# Most recent messages kept per session; older turns are dropped when a session grows past it
+SESSION_MAX_MESSAGES = int(os.environ.get('SESSION_MAX_MESSAGES', 200))
+# Upper bound on a session's encoded size, below DynamoDB's 400KB item limit
+SESSION_MAX_BYTES = 350 * 1024
+# Attempts at a versioned DynamoDB write before giving up on a contended session
+APPEND_ATTEMPTS = 5
+
+# ------------------------------------------------------
+# Compact per-session message encoding
+# Each session is stored as one zlib-compressed JSON array of [role, content] pairs,
+# with roles shortened to a single letter.
+
+_ROLE_CODES = {"user": "u", "human": "u", "assistant": "a", "ai": "a", "system": "s"}
+_ROLE_NAMES = {"u": "user", "a": "assistant", "s": "system"}
+
+
+def encode_messages(messages) -> bytes:
+    """Encode a list of {"role", "content"} messages into a compact binary blob."""
+    rows = [[_ROLE_CODES.get(msg["role"], msg["role"]), msg["content"]] for msg in messages]
+    return zlib.compress(json.dumps(rows, separators=(",", ":")).encode("utf-8"))
+
+
+def decode_messages(blob) -> list:
+    """Decode a blob produced by encode_messages back into {"role", "content"} messages."""
+    if not blob:
+        return []
+    rows = json.loads(zlib.decompress(bytes(blob)).decode("utf-8"))
+    return [{"role": _ROLE_NAMES.get(role, role), "content": content} for role, content in rows]
+
+
+def encode_trimmed(messages) -> tuple:
+    """
+    Encode the most recent messages that fit SESSION_MAX_MESSAGES and SESSION_MAX_BYTES.
+    Returns (blob, number of messages kept).
+    """
+    kept = list(messages)[-SESSION_MAX_MESSAGES:] if SESSION_MAX_MESSAGES else list(messages)
+    blob = encode_messages(kept)
+    while len(blob) > SESSION_MAX_BYTES and kept:
+        kept = kept[max(1, len(kept) // 4):]  # Drop the oldest quarter until it fits
+        blob = encode_messages(kept)
+    return blob, len(kept)
+
+
+# ------------------------------------------------------
+# Session stores
+
+class SQLiteSessionStore:
+    """Session store backed by a local SQLite file, used for local runs and tests."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "session_id TEXT PRIMARY KEY, messages BLOB NOT NULL, updated_at REAL NOT NULL)"
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def load(self, session_id):
+        with self._connect() as conn:
+            row = conn.execute("SELECT messages FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        return decode_messages(row[0]) if row else []
+
+    def append(self, session_id, messages):
+        with self._lock, self._connect() as conn:
+            row = conn.execute("SELECT messages FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+            blob, stored = encode_trimmed((decode_messages(row[0]) if row else []) + list(messages))
+            conn.execute(
+                "INSERT OR REPLACE INTO sessions (session_id, messages, updated_at) VALUES (?, ?, ?)",
+                (session_id, blob, time.time()),
+            )
+        return stored
+
+    def clear(self, session_id):
+        with self._lock, self._connect() as conn:
+            conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+
+class DynamoDBSessionStore:
+    """
+    Session store backed by a DynamoDB table with a `session_id` string partition key.
+    Each item carries a version number; appends are conditional on it, so concurrent
+    turns of a session are retried instead of overwriting each other.
+    """
+
+    def __init__(self, table_name, ttl_seconds=30 * 24 * 3600):
+        self.table = boto3.resource('dynamodb').Table(table_name)
+        self.ttl_seconds = ttl_seconds
+
+    def _get(self, session_id):
+        return self.table.get_item(Key={"session_id": session_id}, ConsistentRead=True).get("Item")
+
+    def load(self, session_id):
+        item = self._get(session_id)
+        return decode_messages(item["messages"].value) if item else []
+
+    def append(self, session_id, messages):
+        for attempt in range(APPEND_ATTEMPTS):
+            item = self._get(session_id)
+            version = int(item.get("version", 0)) if item else 0
+            stored_messages = decode_messages(item["messages"].value) if item else []
+            blob, stored = encode_trimmed(stored_messages + list(messages))
+            now = int(time.time())
+            if version:
+                condition = {"ConditionExpression": "version = :version",
+                             "ExpressionAttributeValues": {":version": version}}
+            else:
+                # New session, or one written before items were versioned
+                condition = {"ConditionExpression": "attribute_not_exists(version)"}
+            try:
+                self.table.put_item(Item={
+                    "session_id": session_id,
+                    "messages": blob,
+                    "version": version + 1,
+                    "updated_at": now,
+                    "expires_at": now + self.ttl_seconds,
+                }, **condition)
+                return stored
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                    raise
+                print(f"Session {session_id} changed concurrently, retrying append (attempt {attempt + 1})")
+                time.sleep(0.05 * (attempt + 1))
+        raise RuntimeError(f"Could not append to session {session_id}: too many concurrent writes")
+
+    def clear(self, session_id):
+        self.table.delete_item(Key={"session_id": session_id})
+
+
+def get_session_store():
+    """
+    Return the configured session store: DynamoDB when SESSION_TABLE is set,
+    otherwise a local SQLite file at SESSION_DB_PATH. Inside Lambda, SESSION_TABLE is
+    required: /tmp is per container, so a local file would lose history between instances.
+    """
+    table_name = os.environ.get('SESSION_TABLE')
+    if table_name:
+        return DynamoDBSessionStore(table_name)
+    if os.environ.get('AWS_LAMBDA_FUNCTION_NAME'):
+        raise RuntimeError("SESSION_TABLE must be set when running in Lambda; "
+                           "a local session store would lose history between instances")
+    return SQLiteSessionStore(os.environ.get('SESSION_DB_PATH', '/tmp/tender_eval_sessions.db'))
@@ -1,20 +1,55 @@
+import hashlib
 import json
+import os
+import threading
+import time
+import uuid
 import boto3
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict
 from operator import itemgetter  # Import itemgetter for extracting dictionary keys
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_core.runnables import RunnableParallel
+from langchain_core.runnables import RunnableLambda, RunnableParallel
 from langchain_core.output_parsers import StrOutputParser
-from langchain_aws import ChatBedrock, AmazonKnowledgeBasesRetriever
+from langchain_aws import ChatBedrock
+from retrieval import RETRIEVAL_K, RETRIEVAL_SEARCH_TYPE, make_retriever
+from session_store import get_session_store
+from rate_governor import RateGovernor, ThrottledError
+from evaluation_scores import SCORES_QUESTION, SCORES_INSTRUCTIONS, ScoreStreamParser
+from job_store import get_job_store, new_job_record, FINISHED_STATES, RUNNING, SUCCEEDED, FAILED
+from usage_ledger import (get_usage_ledger, usage_keys, system_usage_key, message_usage, UsageMeter, BudgetPolicy,
+                          BudgetExceededError)
 
 # Amazon Bedrock client setup
 bedrock_runtime = boto3.client('bedrock-runtime', region_name="us-east-1")
+bedrock_agent_runtime = boto3.client('bedrock-agent-runtime', region_name="us-east-1")  # Knowledge Base retrieval
 s3_client = boto3.client('s3')  # S3 client to fetch context from S3 bucket
+lambda_client = boto3.client('lambda')  # Used to run submitted jobs asynchronously
+
+# Server-side conversation history, so clients only send a session id and the new question
+session_store = get_session_store()
+
+# Token and cost usage per session and per user per day, and the budgets enforced on it
+usage_ledger = get_usage_ledger()
+budget_policy = BudgetPolicy.from_env()
 
 # Define the S3 bucket and object key for the evaluation criteria file
 bucket_name = 'tender-eval-bucket'
 object_key = 'prompt-files/evaluation_criteria.txt'
 
+# Batch requests: maximum checklist size and number of concurrent retrievals/generations
+BATCH_MAX_QUESTIONS = 25
+BATCH_WORKERS = int(os.environ.get('BATCH_WORKERS', 8))
+
+# Status, partial output and results of asynchronous jobs
+job_store = get_job_store(bucket_name)
+# Minimum time between partial result writes while a job is streaming
+JOB_PARTIAL_INTERVAL_SECONDS = 1.0
+# Function that runs batch and background jobs, deployed from this code with its own reserved
+# concurrency so that work can never take the capacity interactive chat needs
+BACKGROUND_JOB_FUNCTION = os.environ.get('BACKGROUND_JOB_FUNCTION')
+
 # Function to read context from S3 bucket
 def read_s3_file(bucket_name, object_key):
     """
@@ -30,8 +65,9 @@ def read_s3_file(bucket_name, object_key):
 evaluation_criteria = read_s3_file(bucket_name, object_key)
 template = "'''"+evaluation_criteria+"'''"  
 
-# Define Bedrock model and configuration
-model_id = "anthropic.claude-3-haiku-20240307-v1:0"
+# Define Bedrock model and configuration; FALLBACK_MODEL_ID (if set) is used for sessions
+# close to their token budget and must accept the same model_kwargs
+model_id = os.environ.get('MODEL_ID', "anthropic.claude-3-haiku-20240307-v1:0")
 model_kwargs = {
     "max_tokens": 2048,
     "temperature": 0.9,
@@ -49,32 +85,102 @@ prompt = ChatPromptTemplate.from_messages(
     ]
 )
 
-# Amazon Bedrock - KnowledgeBase Retriever
-retriever = AmazonKnowledgeBasesRetriever(
-    knowledge_base_id="FYNKYVWUPB",  # Your KnowledgeBase ID
-    retrieval_config={"vectorSearchConfiguration": {"numberOfResults": 4}},
+# Prompt for structured scores: one JSON object per criterion per line
+scores_prompt = ChatPromptTemplate.from_messages(
+    [
+        ("system", "You are a helpful assistant. Answer the question based only on the following context:\n {context}"+template
+         + SCORES_INSTRUCTIONS.replace("{", "{{").replace("}", "}}")),  # Escape the JSON example's braces
+        ("human", "{question}")
+    ]
 )
 
+# Amazon Bedrock - KnowledgeBase Retriever
+knowledge_base_id = "FYNKYVWUPB"  # Your KnowledgeBase ID
+
+@lru_cache(maxsize=32)
+def get_retriever(documents=(), k=RETRIEVAL_K, search_type=RETRIEVAL_SEARCH_TYPE):
+    """Return a retriever scoped to the given document keys, or the whole knowledge base."""
+    return make_retriever(knowledge_base_id, bedrock_agent_runtime, bucket_name, documents, k, search_type)
+
 # Bedrock Chat Model
-model = ChatBedrock(
-    client=bedrock_runtime,
-    model_id=model_id,
-    model_kwargs=model_kwargs,
+@lru_cache(maxsize=4)
+def get_model(selected_model_id=model_id):
+    return ChatBedrock(
+        client=bedrock_runtime,
+        model_id=selected_model_id,
+        model_kwargs=model_kwargs,
+    )
+
+# Rate governors for the model and the Knowledge Base, sized from the account quotas.
+# Limits apply per Lambda instance, so set them to each function's share of the quota
+# divided by its reserved concurrency. Priority between chat and batch/background work
+# is enforced by running those jobs in BACKGROUND_JOB_FUNCTION, not by the governors.
+model_governor = RateGovernor(
+    "model",
+    requests_per_minute=int(os.environ.get('MODEL_REQUESTS_PER_MINUTE', 200)),
+    tokens_per_minute=int(os.environ.get('MODEL_TOKENS_PER_MINUTE', 200000)),
+)
+retriever_governor = RateGovernor(
+    "retriever",
+    requests_per_minute=int(os.environ.get('RETRIEVE_REQUESTS_PER_MINUTE', 600)),
 )
 
+def request_config(priority="interactive", selected_model_id=None, meter=None):
+    """Chain config carrying the request's priority, model and usage meter."""
+    return {"configurable": {"priority": priority, "model_id": selected_model_id or model_id, "usage": meter}}
+
+def _priority(config):
+    return config.get("configurable", {}).get("priority", "interactive")
+
+def _model_id(config):
+    return config.get("configurable", {}).get("model_id") or model_id
+
+def meter_usage(meter, selected_model_id, prompt_value, usage, response_text):
+    """Add a model call to the request's usage meter, estimating tokens if the model reported none."""
+    if meter is None:
+        return
+    if usage is None:
+        usage = (len(prompt_value.to_string()) // 4, len(response_text) // 4)
+    meter.add(selected_model_id, *usage)
+
+def add_usage(total, chunk):
+    """Sum the usage reported on stream chunks; Bedrock reports it on the last chunk."""
+    usage = message_usage(chunk)
+    if usage is None:
+        return total
+    return usage if total is None else (total[0] + usage[0], total[1] + usage[1])
+
+def governed_retrieve(inputs, config):
+    """Retrieve chunks for the question within the requested documents, through the rate governor."""
+    scoped_retriever = get_retriever(tuple(sorted(inputs.get("documents") or ())))
+    return retriever_governor.call(scoped_retriever.invoke, inputs["question"], priority=_priority(config))
+
+def estimate_tokens(prompt_value):
+    """Rough prompt plus completion token budget for a model call."""
+    return len(prompt_value.to_string()) // 4 + model_kwargs["max_tokens"]
+
+def governed_generate(prompt_value, config):
+    """Invoke the model through its rate governor, budgeting prompt plus completion tokens."""
+    selected_model_id = _model_id(config)
+    message = model_governor.call(get_model(selected_model_id).invoke, prompt_value, priority=_priority(config),
+                                  tokens=estimate_tokens(prompt_value))
+    meter_usage(config.get("configurable", {}).get("usage"), selected_model_id, prompt_value,
+                message_usage(message), message.content)
+    return message
+
 # Combine the retriever and model into a LangChain execution chain using itemgetter
 chain = (
     RunnableParallel({
-        "context": itemgetter("question") | retriever,  # Use itemgetter for extracting 'question' to pass into retriever
+        "context": RunnableLambda(governed_retrieve),  # Retrieve context for 'question' within the requested 'documents'
         "question": itemgetter("question"),  # Extract 'question' for prompt
         "history": itemgetter("history"),  # Extract 'history' if available
     })
-    .assign(response=prompt | model | StrOutputParser())  # Generate response from the model
+    .assign(response=prompt | RunnableLambda(governed_generate) | StrOutputParser())  # Generate response from the model
 )
 
 # Function to invoke the chain and handle Document objects
-def query_bedrock(question, history):
-    inputs = {"question": question, "history": history}
+def query_bedrock(question, history, priority="interactive", documents=None, selected_model_id=None, meter=None):
+    inputs = {"question": question, "history": history, "documents": documents}
     
     # Ensure that the question is a string before passing it through
     if isinstance(question, dict):
@@ -82,45 +188,421 @@ def query_bedrock(question, history):
         question = json.dumps(question)
     
     # Run the LangChain pipeline
-    output = chain.invoke(inputs)
+    output = chain.invoke(inputs, config=request_config(priority, selected_model_id, meter))
     
     # Process the response and context
     response = output['response']
     
-    # Convert context to JSON-serializable format by extracting page_content and metadata
-    context_data = [
+    return response, serialize_context(output['context'])
+
+# Convert context to JSON-serializable format by extracting page_content and metadata
+def serialize_context(docs):
+    return [
         {
             "page_content": doc.page_content,
             "metadata": doc.metadata
         }
-        for doc in output['context']
+        for doc in docs
     ]
-    
-    return response, context_data
+
+# Function to score documents per criterion, parsing the structured output as it streams
+def score_documents(documents=None, priority="interactive", on_score=None, on_attempt=None,
+                    selected_model_id=None, meter=None):
+    """
+    Score the documents per criterion. on_score gets each record as it is parsed; the whole
+    stream is retried when throttled, so on_attempt is called first on every attempt to
+    discard records reported by an earlier one.
+    """
+    config = request_config(priority, selected_model_id, meter)
+    docs = governed_retrieve({"question": SCORES_QUESTION, "documents": documents}, config)
+    prompt_value = scores_prompt.invoke({"context": docs, "question": SCORES_QUESTION})
+
+    def stream_scores():
+        if on_attempt:
+            on_attempt()
+        parser = ScoreStreamParser()
+        text, usage = "", None
+        for chunk in get_model(_model_id(config)).stream(prompt_value):
+            text += chunk.content
+            usage = add_usage(usage, chunk)
+            for record in parser.feed(chunk.content):
+                if on_score:
+                    on_score(record)
+        for record in parser.close():
+            if on_score:
+                on_score(record)
+        meter_usage(meter, _model_id(config), prompt_value, usage, text)
+        return parser.scores
+
+    scores = model_governor.call(stream_scores, priority=priority, tokens=estimate_tokens(prompt_value))
+    return scores, serialize_context(docs)
+
+# Function to generate a response while reporting the partial text as it streams
+def stream_bedrock(question, history, priority="interactive", documents=None, on_partial=None,
+                   selected_model_id=None, meter=None):
+    config = request_config(priority, selected_model_id, meter)
+    docs = governed_retrieve({"question": question, "documents": documents}, config)
+    prompt_value = prompt.invoke({"context": docs, "question": question, "history": history})
+
+    def stream_response():
+        response, usage = "", None
+        for chunk in get_model(_model_id(config)).stream(prompt_value):
+            response += chunk.content
+            usage = add_usage(usage, chunk)
+            if on_partial:
+                on_partial(response)
+        meter_usage(meter, _model_id(config), prompt_value, usage, response)
+        return response
+
+    response = model_governor.call(stream_response, priority=priority, tokens=estimate_tokens(prompt_value))
+    return response, serialize_context(docs)
+
+# Stable id for a retrieved chunk, so chunks shared by several questions are returned once
+def context_chunk_id(doc):
+    uri = doc.metadata.get('location', {}).get('s3Location', {}).get('uri', '')
+    return hashlib.sha256(f"{uri}\n{doc.page_content}".encode('utf-8')).hexdigest()[:16]
+
+# Function to answer a checklist of questions with concurrent retrieval and generation
+def run_batch(questions, documents=None, priority="batch", on_item=None, selected_model_id=None, meter=None):
+    config = request_config(priority, selected_model_id, meter)
+    unique_questions = list(dict.fromkeys(questions))  # Repeated questions share one retrieval and generation
+
+    def retrieve(question):
+        try:
+            return governed_retrieve({"question": question, "documents": documents}, config), None
+        except Exception as e:
+            return None, e
+
+    def generate(question):
+        # Starts as soon as this question's own retrieval has finished
+        docs, error = retrievals[question].result()
+        if error is not None:
+            raise error
+        prompt_value = prompt.invoke({"context": docs, "question": question, "history": []})
+        return governed_generate(prompt_value, config).content
+
+    chunks = {}
+    answers = {}
+    with ThreadPoolExecutor(max_workers=BATCH_WORKERS) as pool:
+        # Retrievals are queued first, so generations never wait on a retrieval that has not started
+        retrievals = {question: pool.submit(retrieve, question) for question in unique_questions}
+        generations = {question: pool.submit(generate, question) for question in unique_questions}
+        for question, future in generations.items():
+            docs = retrievals[question].result()[0] or []
+            for doc in docs:
+                chunks.setdefault(context_chunk_id(doc), {"page_content": doc.page_content, "metadata": doc.metadata})
+            item = {"question": question, "chunk_ids": list(dict.fromkeys(context_chunk_id(doc) for doc in docs))}
+            try:
+                item.update(status="ok", response=future.result())
+            except ThrottledError as e:
+                item.update(status="error", error=str(e), retryable=True, retry_after=e.retry_after)
+            except Exception as e:
+                item.update(status="error", error=str(e))
+            answers[question] = item
+            if on_item:
+                on_item(item)
+
+    return {"items": [answers[question] for question in questions], "chunks": chunks}
+
+def validate_batch(questions):
+    """Return an error message if a batch request's questions are not usable."""
+    if not isinstance(questions, list) or not questions or not all(isinstance(q, str) and q.strip() for q in questions):
+        return "'questions' must be a non-empty list of questions"
+    if len(questions) > BATCH_MAX_QUESTIONS:
+        return f"A batch can contain at most {BATCH_MAX_QUESTIONS} questions"
+    return None
+
+# Store a question and its answer in the session's server-side history
+def record_session_turn(session_id, question, response):
+    if session_id:
+        session_store.append(session_id, [
+            {"role": "user", "content": question},
+            {"role": "assistant", "content": response},
+        ])
+
+# ------------------------------------------------------
+# Token usage ledger and budgets
+
+def usage_totals(session_id, user_id):
+    """Running usage of a session and of its user today, with the budgets they are held to."""
+    session_key, user_key = usage_keys(session_id, user_id)
+    return {
+        "session": dict(usage_ledger.totals(session_key), budget=budget_policy.session_budget) if session_key else None,
+        "user": dict(usage_ledger.totals(user_key), budget=budget_policy.user_daily_budget) if user_key else None,
+    }
+
+def plan_request(session_id, user_id, history):
+    """
+    Apply the budgets before a request. Returns the history and model id to use and the
+    budget state passed on to record_usage; raises BudgetExceededError once a budget is spent.
+    """
+    totals = usage_totals(session_id, user_id)
+    plan = budget_policy.plan(totals["session"], totals["user"])
+    if plan["trim_history"]:
+        keep = budget_policy.trimmed_history_messages
+        history = history[-keep:] if keep else []
+    selected_model_id = budget_policy.fallback_model_id if plan["use_fallback"] else model_id
+    return history, selected_model_id, {"totals": totals, "degraded": [name for name, applied in plan.items() if applied]}
+
+def record_usage(session_id, user_id, meter, budget, priority="interactive"):
+    """
+    Record a request's usage in the ledger and return it with the updated running totals.
+    Requests with no session or user, such as report pre-generation, go under a system key.
+    """
+    keys = [key for key in usage_keys(session_id, user_id) if key] or [system_usage_key(priority)]
+    if meter.input_tokens or meter.output_tokens:
+        usage_ledger.record(keys, meter.input_tokens, meter.output_tokens, meter.cost)
+    totals = budget["totals"]
+    for scope_totals in totals.values():
+        if scope_totals is not None:
+            scope_totals.update(input_tokens=scope_totals["input_tokens"] + meter.input_tokens,
+                                output_tokens=scope_totals["output_tokens"] + meter.output_tokens,
+                                cost=round(scope_totals["cost"] + meter.cost, 6), requests=scope_totals["requests"] + 1)
+    return dict(meter.as_dict(), degraded=budget["degraded"], totals=totals)
+
+# ------------------------------------------------------
+# Asynchronous jobs: submit returns a job id at once, a worker invocation runs the
+# request and writes partial and final results to the job store, clients poll and fetch
+
+def job_priority(request):
+    return request.get('priority') or ('batch' if request.get('mode') == 'batch' else 'interactive')
+
+def submit_job(event, context):
+    job_id = uuid.uuid4().hex
+    request = {key: event[key] for key in ('question', 'questions', 'session_id', 'user_id', 'documents', 'priority', 'mode')
+               if event.get(key) is not None}
+    if request.get('mode') == 'batch' and validate_batch(request.get('questions')):
+        return {'statusCode': 400, 'body': json.dumps({'error': validate_batch(request.get('questions'))})}
+    # Reject at once when a budget is already spent, rather than when the job runs
+    plan_request(request.get('session_id'), request.get('user_id'), [])
+    job_store.put(new_job_record(job_id, request))
+
+    if context is not None and getattr(context, 'function_name', None) and os.environ.get('JOB_RUNNER') != 'thread':
+        # Run the job in a separate asynchronous invocation; batch and background jobs go to
+        # their own function, whose reserved concurrency caps them across all instances
+        function_name = context.function_name
+        if BACKGROUND_JOB_FUNCTION and job_priority(request) != 'interactive':
+            function_name = BACKGROUND_JOB_FUNCTION
+        lambda_client.invoke(
+            FunctionName=function_name,
+            InvocationType='Event',
+            Payload=json.dumps({"action": "run_job", "job_id": job_id}),
+        )
+    else:
+        # Local runs have no function to invoke, so run the job in this process
+        threading.Thread(target=run_job, args=(job_id,), daemon=True).start()
+
+    return {
+        'statusCode': 202,
+        'body': json.dumps({"job_id": job_id, "status": "queued"})
+    }
+
+def run_job(job_id):
+    record = job_store.get(job_id)
+    if record is None or record["status"] in FINISHED_STATES:
+        return
+    record["status"] = RUNNING
+    job_store.put(record)
+
+    last_write = {"at": 0.0}
+    def publish(**fields):
+        record.update(fields)
+        if time.time() - last_write["at"] >= JOB_PARTIAL_INTERVAL_SECONDS:
+            job_store.put(record)
+            last_write["at"] = time.time()
+
+    request = record["request"]
+    priority = job_priority(request)
+    session_id, user_id = request.get('session_id'), request.get('user_id')
+    meter = UsageMeter()
+    try:
+        if request.get('mode') == 'scores':
+            _, selected_model_id, budget = plan_request(session_id, user_id, [])
+            partial_scores = []
+            def on_score(score):
+                partial_scores.append(score)
+                publish(partial_scores=list(partial_scores))
+            def on_attempt():
+                # A throttled stream is retried from the start; drop the scores of the failed attempt
+                if partial_scores:
+                    partial_scores.clear()
+                    publish(partial_scores=[])
+            scores, context_data = score_documents(request.get('documents'), priority=priority, on_score=on_score,
+                                                   on_attempt=on_attempt,
+                                                   selected_model_id=selected_model_id, meter=meter)
+            result = {"scores": scores, "context": context_data}
+        elif request.get('mode') == 'batch':
+            _, selected_model_id, budget = plan_request(session_id, user_id, [])
+            partial_items = []
+            def on_item(item):
+                partial_items.append(item)
+                publish(partial_items=list(partial_items))
+            result = run_batch(request['questions'], documents=request.get('documents'),
+                               priority=priority, on_item=on_item,
+                               selected_model_id=selected_model_id, meter=meter)
+        else:
+            question = request.get('question', 'No question provided')
+            history = session_store.load(session_id) if session_id else []
+            history, selected_model_id, budget = plan_request(session_id, user_id, history)
+            response, context_data = stream_bedrock(question, history, priority=priority, documents=request.get('documents'),
+                                                    on_partial=lambda text: publish(partial_response=text),
+                                                    selected_model_id=selected_model_id, meter=meter)
+            record_session_turn(session_id, question, response)
+            result = {"response": response, "context": context_data}
+        result["usage"] = record_usage(session_id, user_id, meter, budget, priority)
+        record.update(status=SUCCEEDED, result=result)
+    except BudgetExceededError as e:
+        record.update(status=FAILED, error=str(e), budget_exceeded=True)
+    except ThrottledError as e:
+        record.update(status=FAILED, error=str(e), retryable=True, retry_after=e.retry_after)
+    except Exception as e:
+        record.update(status=FAILED, error=str(e))
+    job_store.put(record)
+
+def handle_job_action(action, event, context):
+    if action == 'submit_job':
+        return submit_job(event, context)
+    if action == 'run_job':
+        run_job(event['job_id'])
+        return {'statusCode': 200, 'body': json.dumps({"job_id": event['job_id']})}
+
+    record = job_store.get(event.get('job_id', ''))
+    if record is None:
+        return {'statusCode': 404, 'body': json.dumps({'error': f"Unknown job: {event.get('job_id')}"})}
+
+    if action == 'poll_job':
+        # Status and partial output only; the full result is fetched once the job has finished
+        body = {key: record.get(key) for key in ('job_id', 'status', 'session_id', 'partial_response',
+                                                 'partial_scores', 'partial_items', 'error', 'retryable', 'retry_after',
+                                                 'budget_exceeded')}
+        return {'statusCode': 200, 'body': json.dumps(body)}
+
+    # fetch_job
+    if record["status"] not in FINISHED_STATES:
+        return {'statusCode': 409, 'body': json.dumps({"job_id": record["job_id"], "status": record["status"],
+                                                       'error': "Job has not finished"})}
+    return {'statusCode': 200, 'body': json.dumps({"job_id": record["job_id"], "status": record["status"],
+                                                   "session_id": record.get("session_id"), "error": record.get("error"),
+                                                   "result": record.get("result")})}
+
+# Session requests that read or write stored history without invoking the model
+def handle_session_action(action, session_id, event):
+    if not session_id:
+        return {
+            'statusCode': 400,
+            'body': json.dumps({'error': f"'{action}' requires a session_id"})
+        }
+
+    if action == 'get_history':
+        body = {"session_id": session_id, "messages": session_store.load(session_id)}
+    elif action == 'get_usage':
+        body = usage_totals(session_id, event.get('user_id'))
+    elif action == 'append_history':
+        # Record a turn answered without generation, e.g. a pre-generated report
+        body = {"session_id": session_id, "stored": session_store.append(session_id, event.get('messages', []))}
+    elif action == 'clear_history':
+        session_store.clear(session_id)
+        body = {"session_id": session_id, "stored": 0}
+    else:
+        return {
+            'statusCode': 400,
+            'body': json.dumps({'error': f"Unknown action: {action}"})
+        }
+
+    return {
+        'statusCode': 200,
+        'body': json.dumps(body)
+    }
 
 # Lambda Handler
 def lambda_handler(event, context):
     try:
-        # Extract the question and history from the request payload
+        session_id = event.get('session_id')
+        user_id = event.get('user_id')
+        action = event.get('action')
+        if action in ('submit_job', 'run_job', 'poll_job', 'fetch_job'):
+            return handle_job_action(action, event, context)
+        if action:
+            return handle_session_action(action, session_id, event)
+
+        if event.get('mode') == 'scores':
+            # Structured per-criterion scores for the requested documents
+            _, selected_model_id, budget = plan_request(session_id, user_id, [])
+            meter = UsageMeter()
+            scores, context_data = score_documents(event.get('documents'), priority=event.get('priority', 'interactive'),
+                                                   selected_model_id=selected_model_id, meter=meter)
+            return {
+                'statusCode': 200,
+                'body': json.dumps({
+                    "scores": scores,
+                    "context": context_data,
+                    "usage": record_usage(session_id, user_id, meter, budget, job_priority(event))
+                })
+            }
+
+        if event.get('mode') == 'batch':
+            # Checklist of questions answered together with shared retrieval
+            questions = event.get('questions')
+            error = validate_batch(questions)
+            if error:
+                return {
+                    'statusCode': 400,
+                    'body': json.dumps({'error': error})
+                }
+            _, selected_model_id, budget = plan_request(session_id, user_id, [])
+            meter = UsageMeter()
+            result = run_batch(questions, documents=event.get('documents'), priority=event.get('priority', 'batch'),
+                               selected_model_id=selected_model_id, meter=meter)
+            result["usage"] = record_usage(session_id, user_id, meter, budget, job_priority(event))
+            return {
+                'statusCode': 200,
+                'body': json.dumps(result)
+            }
+
+        # Extract the question from the request payload; history comes from the
+        # session store when a session id is given, otherwise from the payload
         question = event.get('question', 'No question provided')
-        history = event.get('history', [])
+        history = session_store.load(session_id) if session_id else event.get('history', [])
 
         # Ensure that the question is a string
         if not isinstance(question, str):
             question = json.dumps(question)
 
+        # Apply the token budgets: trim history or switch model as they run low
+        history, selected_model_id, budget = plan_request(session_id, user_id, history)
+        meter = UsageMeter()
+
         # Invoke Bedrock and LangChain
-        response, context_data = query_bedrock(question, history)
+        response, context_data = query_bedrock(question, history, priority=event.get('priority', 'interactive'),
+                                               documents=event.get('documents'),
+                                               selected_model_id=selected_model_id, meter=meter)
+
+        record_session_turn(session_id, question, response)
 
-        # Return the response and context
+        # Return the response, context and token usage
         return {
             'statusCode': 200,
             'body': json.dumps({
                 "response": response,
-                "context": context_data
+                "context": context_data,
+                "usage": record_usage(session_id, user_id, meter, budget, job_priority(event))
             })
         }
 
+    except BudgetExceededError as e:
+        # Budgets reset with a new conversation or the next day, so retrying will not help
+        return {
+            'statusCode': 429,
+            'body': json.dumps({'error': str(e), 'retryable': False, 'budget_exceeded': True})
+        }
+
+    except ThrottledError as e:
+        # Bedrock is still throttling after retries; tell the client when to try again
+        return {
+            'statusCode': 429,
+            'body': json.dumps({'error': str(e), 'retryable': True, 'retry_after': e.retry_after})
+        }
+
     except Exception as e:
         return {
             'statusCode': 500,
@@ -0,0 +1,214 @@
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from decimal import Decimal
+
+import boto3
+
+# On-demand price in USD per 1,000 input and output tokens
+MODEL_PRICES = {
+    "anthropic.claude-3-haiku-20240307-v1:0": (0.00025, 0.00125),
+    "anthropic.claude-3-sonnet-20240229-v1:0": (0.003, 0.015),
+    "anthropic.claude-3-5-sonnet-20240620-v1:0": (0.003, 0.015),
+    "anthropic.claude-instant-v1": (0.0008, 0.0024),
+    "amazon.titan-text-lite-v1": (0.00015, 0.0002),
+}
+
+
+class BudgetExceededError(Exception):
+    """Raised when a session or user has used up its token budget."""
+
+
+def request_cost(model_id, input_tokens, output_tokens):
+    input_price, output_price = MODEL_PRICES.get(model_id, (0.0, 0.0))
+    return input_tokens / 1000 * input_price + output_tokens / 1000 * output_price
+
+
+def message_usage(message):
+    """Return (input tokens, output tokens) reported on a model message or stream chunk, or None."""
+    usage = getattr(message, "usage_metadata", None)
+    if usage:
+        return usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+    usage = (getattr(message, "response_metadata", None) or {}).get("usage")
+    if usage:
+        return (usage.get("prompt_tokens", usage.get("input_tokens", 0)),
+                usage.get("completion_tokens", usage.get("output_tokens", 0)))
+    return None
+
+
+class UsageMeter:
+    """Thread-safe tally of the model calls made while serving one request."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.cost = 0.0
+        self.models = set()
+
+    def add(self, model_id, input_tokens, output_tokens):
+        with self._lock:
+            self.input_tokens += input_tokens
+            self.output_tokens += output_tokens
+            self.cost += request_cost(model_id, input_tokens, output_tokens)
+            self.models.add(model_id)
+
+    def as_dict(self):
+        return {"input_tokens": self.input_tokens, "output_tokens": self.output_tokens,
+                "cost": round(self.cost, 6), "models": sorted(self.models)}
+
+
+def _empty_totals():
+    return {"input_tokens": 0, "output_tokens": 0, "cost": 0.0, "requests": 0}
+
+
+def usage_keys(session_id, user_id):
+    """
+    Ledger keys a request is counted under, as (session key, user key): its session, and
+    its user for the current UTC day. A key is None when the request has no such id.
+    """
+    session_key = f"session#{session_id}" if session_id else None
+    user_key = f"user#{user_id}#{datetime.now(timezone.utc):%Y-%m-%d}" if user_id else None
+    return session_key, user_key
+
+
+def system_usage_key(priority):
+    """Ledger key for a request with no session or user, e.g. report pre-generation, per UTC day."""
+    source = "pregeneration" if priority == "background" else priority or "unattributed"
+    return f"system#{source}#{datetime.now(timezone.utc):%Y-%m-%d}"
+
+
+# ------------------------------------------------------
+# Ledgers
+
+class SQLiteUsageLedger:
+    """Usage ledger backed by a local SQLite file, used for local runs and tests."""
+
+    def __init__(self, path):
+        self.path = path
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS usage ("
+                "usage_key TEXT PRIMARY KEY, input_tokens INTEGER NOT NULL, output_tokens INTEGER NOT NULL, "
+                "cost REAL NOT NULL, requests INTEGER NOT NULL, updated_at REAL NOT NULL)"
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def record(self, keys, input_tokens, output_tokens, cost):
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT INTO usage VALUES (?, ?, ?, ?, 1, ?) ON CONFLICT(usage_key) DO UPDATE SET "
+                "input_tokens = input_tokens + excluded.input_tokens, "
+                "output_tokens = output_tokens + excluded.output_tokens, "
+                "cost = cost + excluded.cost, requests = requests + 1, updated_at = excluded.updated_at",
+                [(key, input_tokens, output_tokens, cost, time.time()) for key in keys],
+            )
+
+    def totals(self, key):
+        with self._connect() as conn:
+            row = conn.execute("SELECT input_tokens, output_tokens, cost, requests FROM usage WHERE usage_key = ?",
+                               (key,)).fetchone()
+        if not row:
+            return _empty_totals()
+        return {"input_tokens": row[0], "output_tokens": row[1], "cost": row[2], "requests": row[3]}
+
+
+class DynamoDBUsageLedger:
+    """Usage ledger backed by a DynamoDB table with a `usage_key` string partition key."""
+
+    def __init__(self, table_name, ttl_seconds=90 * 24 * 3600):
+        self.table = boto3.resource('dynamodb').Table(table_name)
+        self.ttl_seconds = ttl_seconds
+
+    def record(self, keys, input_tokens, output_tokens, cost):
+        now = int(time.time())
+        for key in keys:
+            # ADD is atomic, so concurrent requests of a session are all counted
+            self.table.update_item(
+                Key={"usage_key": key},
+                UpdateExpression="ADD input_tokens :i, output_tokens :o, cost :c, requests :one "
+                                 "SET updated_at = :now, expires_at = :expires",
+                ExpressionAttributeValues={":i": input_tokens, ":o": output_tokens,
+                                           ":c": Decimal(str(round(cost, 8))), ":one": 1,
+                                           ":now": now, ":expires": now + self.ttl_seconds},
+            )
+
+    def totals(self, key):
+        item = self.table.get_item(Key={"usage_key": key}).get("Item")
+        if not item:
+            return _empty_totals()
+        return {"input_tokens": int(item["input_tokens"]), "output_tokens": int(item["output_tokens"]),
+                "cost": float(item["cost"]), "requests": int(item["requests"])}
+
+
+def get_usage_ledger():
+    """
+    Return the configured usage ledger: DynamoDB when USAGE_TABLE is set,
+    otherwise a local SQLite file at USAGE_DB_PATH. Inside Lambda, USAGE_TABLE is
+    required: /tmp is per container, so budgets would not hold across instances.
+    """
+    table_name = os.environ.get('USAGE_TABLE')
+    if table_name:
+        return DynamoDBUsageLedger(table_name)
+    if os.environ.get('AWS_LAMBDA_FUNCTION_NAME'):
+        raise RuntimeError("USAGE_TABLE must be set when running in Lambda; "
+                           "a local usage ledger would not be shared between instances")
+    return SQLiteUsageLedger(os.environ.get('USAGE_DB_PATH', '/tmp/tender_eval_usage.db'))
+
+
+# ------------------------------------------------------
+# Budgets
+
+class BudgetPolicy:
+    """
+    Token budgets per session and per user per day (0 disables a budget). As usage
+    approaches a budget, requests degrade step by step: conversation history is trimmed,
+    then the fallback model is used, and once the budget is spent requests are rejected.
+    """
+
+    def __init__(self, session_budget=0, user_daily_budget=0, trim_at=0.5, fallback_at=0.8,
+                 trimmed_history_messages=4, fallback_model_id=None):
+        self.session_budget = session_budget
+        self.user_daily_budget = user_daily_budget
+        self.trim_at = trim_at
+        self.fallback_at = fallback_at
+        self.trimmed_history_messages = trimmed_history_messages
+        self.fallback_model_id = fallback_model_id
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            session_budget=int(os.environ.get('SESSION_TOKEN_BUDGET', 300000)),
+            user_daily_budget=int(os.environ.get('USER_DAILY_TOKEN_BUDGET', 0)),
+            trim_at=float(os.environ.get('BUDGET_TRIM_AT', 0.5)),
+            fallback_at=float(os.environ.get('BUDGET_FALLBACK_AT', 0.8)),
+            trimmed_history_messages=int(os.environ.get('BUDGET_TRIMMED_HISTORY_MESSAGES', 4)),
+            fallback_model_id=os.environ.get('FALLBACK_MODEL_ID'),
+        )
+
+    @staticmethod
+    def _used_share(totals, budget):
+        if not budget or totals is None:
+            return 0.0
+        return (totals["input_tokens"] + totals["output_tokens"]) / budget
+
+    def plan(self, session_totals, user_totals):
+        """
+        Return the degradations for the next request, as {"trim_history", "use_fallback"}.
+        Raises BudgetExceededError once a budget is used up.
+        """
+        session_share = self._used_share(session_totals, self.session_budget)
+        user_share = self._used_share(user_totals, self.user_daily_budget)
+        if session_share >= 1:
+            raise BudgetExceededError("This conversation has used up its token budget; start a new conversation")
+        if user_share >= 1:
+            raise BudgetExceededError("Your daily token budget has been used up; try again tomorrow")
+        share = max(session_share, user_share)
+        return {
+            "trim_history": share >= self.trim_at,
+            "use_fallback": share >= self.fallback_at and bool(self.fallback_model_id),
+        }
@@ -2,83 +2,54 @@ import time
 import streamlit as st
 import requests
 import json
-import boto3
-from pydantic import BaseModel
-from typing import List, Dict, Union, Any
 from langchain_community.chat_message_histories import StreamlitChatMessageHistory
-from components.layout import render_sidebar
+from components.layout import render_sidebar, get_document_scope
+from components.chat_history import render_chat_history, render_history_log
+from components.citations import render_citations
+from components.lambda_client import post_coalesced, fetch_session_history
+from components.session import get_session_id, get_user_id, new_session_id
+from components.usage import remember_usage, render_usage_sidebar
+from components.singleflight import request_key
+from components.report_cache import criteria_version
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from botocore.exceptions import NoCredentialsError
 from components.layout import render_sidebar
 
 # Set page configuration to change the title and favicon of the app
 st.set_page_config(page_title="Tender Evaluation Bot", page_icon="🤖")
 
-# API Gateway URL for your Lambda function
-LAMBDA_API_URL = "https://9d859kfrp7.execute-api.us-east-1.amazonaws.com/dev/ask"
 # Load evaluation criteria and prompt file path from the S3 bucket using the sidebar
 #render_sidebar()
 #with st.expander("Evaluation Documents "):
 render_sidebar()
-# ------------------------------------------------------
-# Pydantic data model for Citations
-class Citation(BaseModel):
-    page_content: str
-    metadata: Dict[str, Union[str, float, Dict[str, Any], None]]  # Flexible handling of metadata
-
-# Helper function to extract citations from the response
-def extract_citations(response: List[Dict]) -> List[Citation]:
-    return [Citation(page_content=doc.get("page_content", ""), metadata=doc.get("metadata", {})) for doc in response]
-
-# ------------------------------------------------------
-# S3 Presigned URL function
-def create_presigned_url(bucket_name: str, object_name: str, expiration: int = 300) -> str:
-    """Generate a presigned URL to share an S3 object"""
-    s3_client = boto3.client('s3')
-    try:
-        response = s3_client.generate_presigned_url('get_object',
-            Params={'Bucket': bucket_name,
-                    'Key': object_name},
-            ExpiresIn=expiration)
-    except NoCredentialsError:
-        st.error("AWS credentials not available")
-        return ""
-    return response
-
-def parse_s3_uri(uri: str) -> tuple:
-    """Parse S3 URI to extract bucket and key"""
-    parts = uri.replace("s3://", "").split("/")
-    bucket = parts[0]
-    key = "/".join(parts[1:])
-    return bucket, key
-
 # ------------------------------------------------------
 # Function to call Lambda API
-def call_lambda(question, history):
-    # Prepare the payload with the question and entire conversation history
+def call_lambda(question):
+    # Prepare the payload with the session id and the new question; the conversation
+    # history is kept server-side so the request size stays constant
+    # Limit retrieval to the evaluation document selected in the sidebar
+    documents = get_document_scope()
     payload = {
+        "session_id": get_session_id(),
+        "user_id": get_user_id(),
         "question": question,
-        "history": [{"role": "user", "content": question}] + history  # Add the current user message first
+        "documents": documents,
     }
 
-    headers = {
-        "Content-Type": "application/json"
-    }
+    # Identical concurrent questions (same criteria, documents and history) share one call
+    flight_key = request_key(question, criteria_version(), documents=documents,
+                             history=st.session_state.messages[1:-1])
 
     try:
         # Make POST request to Lambda API
-        response = requests.post(LAMBDA_API_URL, json=payload, headers=headers)
-        response.raise_for_status()
-
-        # Print the raw response for debugging
-        print("Raw Lambda API response:", response.text)
-
-        # Process Lambda response
-        response_data = response.json()
-        if "body" in response_data:
-            return json.loads(response_data["body"])  # Decode the JSON string in the 'body' field
-
-        return response_data
+        response = post_coalesced(payload, flight_key)
+        if response.get("retryable"):
+            st.warning("The evaluation service is busy right now, please try again in a moment.")
+            return None
+        if response.get("budget_exceeded"):
+            st.error(response["error"])
+            return None
+        remember_usage(response)
+        return response
 
     except requests.exceptions.RequestException as e:
         st.error(f"Error calling Lambda: {e}")
@@ -86,9 +57,20 @@ def call_lambda(question, history):
 
 # ------------------------------------------------------
 # Function to handle conversation
-def handle_conversation(question, history):
+def handle_conversation(question):
     # Call the Lambda function and return the result
-    return call_lambda(question, history)
+    return call_lambda(question)
+
+# Load the stored conversation when resuming a session from another app instance
+def load_session_messages():
+    session_id = get_session_id()
+    if not st.session_state.session_resumed:
+        return []
+    try:
+        return fetch_session_history(session_id)
+    except requests.exceptions.RequestException as e:
+        st.error(f"Error loading conversation history: {e}")
+        return []
 
 # ------------------------------------------------------
 # Streamlit Chat Message History
@@ -100,6 +82,8 @@ history = StreamlitChatMessageHistory(key="chat_messages")
 # Clear Chat History function
 def clear_chat_history():
     st.session_state.messages = [{"role": "assistant", "content": "How may I assist you today?"}]
+    new_session_id()  # Start a fresh server-side conversation
+    st.session_state.pop("usage_totals", None)  # Usage is counted per conversation
     history.clear()
 # Function to simulate streaming response (optional)
 def simulate_streaming_response(full_response, placeholder):
@@ -114,21 +98,15 @@ with st.sidebar:
     streaming_on = st.checkbox('Streaming')
     st.button('Clear Chat History', on_click=clear_chat_history)
     
-    # Display the conversation history logs as structured JSON-like objects
-    st.write("### History Logs")
-    if "messages" in st.session_state:
-        st.json(st.session_state.messages)  # Display the JSON-like format
-    else:
-        st.write("No history available.")
+    # Display the conversation history logs lazily, latest page only
+    render_history_log(st.session_state.get("messages", []))
 
 # Initialize session state for messages if not already present
 if "messages" not in st.session_state:
-    st.session_state.messages = [{"role": "assistant", "content": "How may I assist you today?"}]
+    st.session_state.messages = [{"role": "assistant", "content": "How may I assist you today?"}] + load_session_messages()
 
-# Display previous messages in chat window
-for message in st.session_state.messages:
-    with st.chat_message(message["role"]):
-        st.write(message["content"])
+# Display previous messages in chat window, collapsing older turns
+render_chat_history(st.session_state.messages)
 
 # Chat Input - User Prompt
 if prompt := st.chat_input():
@@ -137,12 +115,9 @@ if prompt := st.chat_input():
     with st.chat_message("user"):
         st.write(prompt)
 
-    # Prepare the chat history for the Lambda payload, excluding the current prompt
-    history_payload = [{"role": msg["role"], "content": msg["content"]} for msg in st.session_state.messages[:-1]]
-
     # Add a spinner while waiting for the Lambda response
     with st.spinner("Waiting for response..."):
-        response = handle_conversation(prompt, history_payload)
+        response = handle_conversation(prompt)
 
     if response:
         full_response = response.get("response", "No response")
@@ -169,20 +144,10 @@ if prompt := st.chat_input():
         # Add assistant response to session state
         st.session_state.messages.append({"role": "assistant", "content": full_response})
 
-        # Citations (if any) with S3 pre-signed URL
-        if context_data:
-            citations = extract_citations(context_data)
-            with st.expander("Show source details >"):
-                for citation in citations:
-                    st.write("Page Content:", citation.page_content)
-                    s3_uri = citation.metadata.get('location', {}).get('s3Location', {}).get('uri', "")
-                    if s3_uri:
-                        bucket, key = parse_s3_uri(s3_uri)
-                        presigned_url = create_presigned_url(bucket, key)
-                        if presigned_url:
-                            st.markdown(f"Source: [{s3_uri}]({presigned_url})")
-                        else:
-                            st.write(f"Source: {s3_uri} (Presigned URL generation failed)")
-                    st.write("Score:", citation.metadata.get('score', 'N/A'))
+        # Citations grouped by source document, with S3 pre-signed URLs
+        render_citations(context_data)
     else:
         st.error("Failed to retrieve response from Lambda.")
+
+# Running token usage and cost, including the answer just given
+render_usage_sidebar()
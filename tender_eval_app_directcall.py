@@ -4,19 +4,22 @@
 # ------------------------------------------------------
 
 import boto3
+import hashlib
 import logging
-from botocore.exceptions import ClientError,NoCredentialsError
-from typing import List, Dict
-from pydantic import BaseModel
+from functools import lru_cache
+from botocore.exceptions import ClientError
 from operator import itemgetter
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_core.runnables import RunnablePassthrough, RunnableParallel
+from langchain_core.runnables import RunnableLambda, RunnablePassthrough, RunnableParallel
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.runnables.history import RunnableWithMessageHistory
 from langchain_aws import ChatBedrock
-from langchain_aws import AmazonKnowledgeBasesRetriever
 from langchain_community.chat_message_histories import StreamlitChatMessageHistory
-from components.layout import render_sidebar
+from components.layout import render_sidebar, get_document_scope
+from components.chat_history import render_chat_history, render_history_log
+from components.citations import render_citations
+from components.singleflight import LeaderAbandonedError, request_flights, request_key
+from lambdafiles.retrieval import make_retriever
 import streamlit as st
 
 # Page title
@@ -36,6 +39,13 @@ bedrock_runtime = boto3.client(
     region_name="us-east-1",
 )
 
+bedrock_agent_runtime = boto3.client(
+    service_name="bedrock-agent-runtime",
+    region_name="us-east-1",
+)
+
+bucket_name = 'tender-eval-bucket'
+
 model_id = "anthropic.claude-3-haiku-20240307-v1:0"
 
 model_kwargs =  { 
@@ -64,10 +74,15 @@ prompt = ChatPromptTemplate.from_messages(
 )
 print(prompt)
 # Amazon Bedrock - KnowledgeBase Retriever 
-retriever = AmazonKnowledgeBasesRetriever(
-    knowledge_base_id="IM2DTVEZHQ", # 👈 Set your Knowledge base ID
-    retrieval_config={"vectorSearchConfiguration": {"numberOfResults": 4}},
-)
+knowledge_base_id = "IM2DTVEZHQ" # 👈 Set your Knowledge base ID
+
+@lru_cache(maxsize=32)
+def get_retriever(documents=()):
+    """Retriever scoped to the given document keys, with the same settings as the Lambda."""
+    return make_retriever(knowledge_base_id, bedrock_agent_runtime, bucket_name, documents)
+
+def scoped_retrieve(inputs):
+    return get_retriever(tuple(sorted(inputs.get("documents") or ()))).invoke(inputs["question"])
 
 model = ChatBedrock(
     client=bedrock_runtime,
@@ -77,7 +92,7 @@ model = ChatBedrock(
 
 chain = (
     RunnableParallel({
-        "context": itemgetter("question") | retriever,
+        "context": RunnableLambda(scoped_retrieve),
         "question": itemgetter("question"),
         "history": itemgetter("history"),
     })
@@ -97,38 +112,6 @@ chain_with_history = RunnableWithMessageHistory(
     output_messages_key="response",
 )
 
-# ------------------------------------------------------
-# Pydantic data model and helper function for Citations
-
-class Citation(BaseModel):
-    page_content: str
-    metadata: Dict
-
-def extract_citations(response: List[Dict]) -> List[Citation]:
-    return [Citation(page_content=doc.page_content, metadata=doc.metadata) for doc in response]
-
-# ------------------------------------------------------
-# S3 Presigned URL
-
-def create_presigned_url(bucket_name: str, object_name: str, expiration: int = 300) -> str:
-    """Generate a presigned URL to share an S3 object"""
-    s3_client = boto3.client('s3')
-    try:
-        response = s3_client.generate_presigned_url('get_object',
-            Params={'Bucket': bucket_name,
-            'Key': object_name},
-            ExpiresIn=expiration)
-    except NoCredentialsError:
-        st.error("AWS credentials not available")
-        return ""
-    return response
-
-def parse_s3_uri(uri: str) -> tuple:
-    """Parse S3 URI to extract bucket and key"""
-    parts = uri.replace("s3://", "").split("/")
-    bucket = parts[0]
-    key = "/".join(parts[1:])
-    return bucket, key
 
 # ------------------------------------------------------
 # Streamlit
@@ -144,17 +127,14 @@ with st.sidebar:
     streaming_on = st.toggle('Streaming')
     st.divider()
     st.button('Clear Chat History', on_click=clear_chat_history)
-    st.write("History Logs")
-    st.write(history.messages)
+    render_history_log(st.session_state.get("messages", []))
 
 # Initialize session state for messages if not already present
 if "messages" not in st.session_state:
     st.session_state.messages = [{"role": "assistant", "content": "How may I assist you today?"}]
 
-# Display chat messages
-for message in st.session_state.messages:
-    with st.chat_message(message["role"]):
-        st.write(message["content"])
+# Display chat messages, collapsing older turns
+render_chat_history(st.session_state.messages)
 # # Predefined message button
 # if st.button("Text inviting friend to wedding", key="predefined_message"):
 #     predefined_message = "I would love to invite you to my wedding! It's going to be an amazing day, and your presence would make it even more special."
@@ -180,57 +160,63 @@ if prompt := st.chat_input():
         st.write(prompt)
 
     config = {"configurable": {"session_id": "any"}}
+
+    # Identical concurrent questions with the same criteria and history share one chain run
+    history_before = len(history.messages)
+    documents = get_document_scope()  # Limit retrieval to the selected evaluation document
+    flight_key = request_key(prompt, hashlib.sha256(template.encode("utf-8")).hexdigest(), documents=documents,
+                             history=[{"role": msg.type, "content": msg.content} for msg in history.messages])
     
     if streaming_on:
         # Chain - Stream
         with st.chat_message("assistant"):
             placeholder = st.empty()
             full_response = ''
-            for chunk in chain_with_history.stream(
-                {"question" : prompt, "history" : history},
+            full_context = []
+            run_chain = lambda: chain_with_history.stream(
+                {"question" : prompt, "history" : history, "documents" : documents},
                 config
-            ):
-                if 'response' in chunk:
-                    full_response += chunk['response']
-                    placeholder.markdown(full_response)
-                else:
-                    full_context = chunk['context']
+            )
+            chunks = request_flights.stream(flight_key, run_chain)
+            while chunks is not None:
+                try:
+                    for chunk in chunks:
+                        if 'response' in chunk:
+                            full_response += chunk['response']
+                            placeholder.markdown(full_response)
+                        elif 'context' in chunk:
+                            full_context = chunk['context']
+                    chunks = None
+                except LeaderAbandonedError:
+                    # The stream this question attached to was stopped; run the chain for this session
+                    full_response = ''
+                    chunks = run_chain()
             placeholder.markdown(full_response)
-            # Citations with S3 pre-signed URL
-            citations = extract_citations(full_context)
-            with st.expander("Show source details >"):
-                for citation in citations:
-                    st.write("Page Content:", citation.page_content)
-                    s3_uri = citation.metadata['location']['s3Location']['uri']
-                    bucket, key = parse_s3_uri(s3_uri)
-                    presigned_url = create_presigned_url(bucket, key)
-                    if presigned_url:
-                        st.markdown(f"Source: [{s3_uri}]({presigned_url})")
-                    else:
-                        st.write(f"Source: {s3_uri} (Presigned URL generation failed)")
-                    st.write("Score:", citation.metadata['score'])
+            # A coalesced stream was recorded in the leading session's history, not this one
+            if len(history.messages) == history_before:
+                history.add_user_message(prompt)
+                history.add_ai_message(full_response)
+            # Citations grouped by source document, with S3 pre-signed URLs
+            render_citations(full_context)
             # session_state append
             st.session_state.messages.append({"role": "assistant", "content": full_response})
     else:
         # Chain - Invoke
         with st.chat_message("assistant"):
-            response = chain_with_history.invoke(
-                {"question" : prompt, "history" : history},
+            run_chain = lambda: chain_with_history.invoke(
+                {"question" : prompt, "history" : history, "documents" : documents},
                 config
             )
+            try:
+                response, shared = request_flights.do(flight_key, run_chain)
+            except LeaderAbandonedError:
+                response, shared = run_chain(), False
+            # A coalesced call was recorded in the leading session's history, not this one
+            if shared:
+                history.add_user_message(prompt)
+                history.add_ai_message(response['response'])
             st.write(response['response'])
-            # Citations with S3 pre-signed URL
-            citations = extract_citations(response['context'])
-            with st.expander("Show source details >"):
-                for citation in citations:
-                    st.write("Page Content:", citation.page_content)
-                    s3_uri = citation.metadata['location']['s3Location']['uri']
-                    bucket, key = parse_s3_uri(s3_uri)
-                    presigned_url = create_presigned_url(bucket, key)
-                    if presigned_url:
-                        st.markdown(f"Source: [{s3_uri}]({presigned_url})")
-                    else:
-                        st.write(f"Source: {s3_uri} (Presigned URL generation failed)")
-                    st.write("Score:", citation.metadata['score'])
+            # Citations grouped by source document, with S3 pre-signed URLs
+            render_citations(response['context'])
             # session_state append
             st.session_state.messages.append({"role": "assistant", "content": response['response']})
@@ -1,93 +1,168 @@
+import os
 import time
 import streamlit as st
 import requests
 import json
-import boto3
-from pydantic import BaseModel
-from typing import List, Dict, Union, Any
 from langchain_community.chat_message_histories import StreamlitChatMessageHistory
-from components.layout import render_sidebar
+from components.layout import render_sidebar, get_document_scope
+from components.chat_history import render_chat_history, render_history_log
+from components.citations import render_citations, prepare_citations, citations_markdown
+from components.lambda_client import post_coalesced, stream_job, fetch_session_history, append_session_history
+from components.session import get_session_id, get_user_id, new_session_id
+from components.usage import remember_usage, render_usage_sidebar
+from components.singleflight import request_key
+from components.score_index import get_score_index
+from components.report_cache import STANDARD_REPORT_QUESTION, criteria_version, get_cached_report
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from botocore.exceptions import NoCredentialsError
 from components.layout import render_sidebar
 
 # Set page configuration to change the title and favicon of the app
 st.set_page_config(page_title="Tender Evaluation Bot", page_icon="🤖")
 
-# API Gateway URL for your Lambda function
-LAMBDA_API_URL = "https://9d859kfrp7.execute-api.us-east-1.amazonaws.com/dev/ask"
-
 render_sidebar()
 
-# ------------------------------------------------------
-# Pydantic data model for Citations
-class Citation(BaseModel):
-    page_content: str
-    metadata: Dict[str, Union[str, float, Dict[str, Any], None]]  # Flexible handling of metadata
-
-# Helper function to extract citations from the response
-def extract_citations(response: List[Dict]) -> List[Citation]:
-    return [Citation(page_content=doc.get("page_content", ""), metadata=doc.get("metadata", {})) for doc in response]
-
-# ------------------------------------------------------
-# S3 Presigned URL function
-def create_presigned_url(bucket_name: str, object_name: str, expiration: int = 300) -> str:
-    """Generate a presigned URL to share an S3 object"""
-    s3_client = boto3.client('s3')
-    try:
-        response = s3_client.generate_presigned_url('get_object',
-            Params={'Bucket': bucket_name,
-                    'Key': object_name},
-            ExpiresIn=expiration)
-    except NoCredentialsError:
-        st.error("AWS credentials not available")
-        return ""
-    return response
-
-def parse_s3_uri(uri: str) -> tuple:
-    """Parse S3 URI to extract bucket and key"""
-    parts = uri.replace("s3://", "").split("/")
-    bucket = parts[0]
-    key = "/".join(parts[1:])
-    return bucket, key
-
 # ------------------------------------------------------
 # Function to call Lambda API
-def call_lambda(question, history):
-    # Prepare the payload with the question and entire conversation history
+def call_lambda(question):
+    # Limit retrieval to the evaluation document selected in the sidebar
+    documents = get_document_scope()
+
+    # Prepare the payload with the session id and the new question; the conversation
+    # history is kept server-side so the request size stays constant
     payload = {
+        "session_id": get_session_id(),
+        "user_id": get_user_id(),
         "question": question,
-        "history": [{"role": "user", "content": question}] + history  # Add the current user message first
+        "documents": documents,
     }
 
-    headers = {
-        "Content-Type": "application/json"
-    }
+    # Identical concurrent questions (same criteria, documents and history) share one call
+    flight_key = request_key(question, criteria_version(), documents=documents,
+                             history=st.session_state.messages[1:-1])
 
     try:
         # Make POST request to Lambda API
-        response = requests.post(LAMBDA_API_URL, json=payload, headers=headers)
-        response.raise_for_status()
-
-        # Print the raw response for debugging
-        print("Raw Lambda API response:", response.text)
+        response = post_coalesced(payload, flight_key)
+        if response.get("retryable"):
+            st.warning("The evaluation service is busy right now, please try again in a moment.")
+            return None
+        if response.get("budget_exceeded"):
+            st.error(response["error"])
+            return None
+        remember_usage(response)
+        return response
 
-        # Process Lambda response
-        response_data = response.json()
-        if "body" in response_data:
-            return json.loads(response_data["body"])  # Decode the JSON string in the 'body' field
+    except requests.exceptions.RequestException as e:
+        st.error(f"Error calling Lambda: {e}")
+        return None
 
-        return response_data
+# ------------------------------------------------------
+# Function to run a long report as an asynchronous job, showing partial output while it runs
+def run_report_job(question):
+    documents = get_document_scope()
+    payload = {
+        "session_id": get_session_id(),
+        "user_id": get_user_id(),
+        "question": question,
+        "documents": documents,
+    }
+    flight_key = request_key(question, criteria_version(), documents=documents,
+                             history=st.session_state.messages[1:-1])
 
+    placeholder = st.empty()
+    record = None
+    try:
+        with st.spinner("Generating evaluation report..."):
+            for record in stream_job(payload, flight_key):
+                if record.get("partial_response"):
+                    placeholder.markdown(record["partial_response"])
     except requests.exceptions.RequestException as e:
         st.error(f"Error calling Lambda: {e}")
         return None
+    finally:
+        placeholder.empty()
+
+    if not record or record.get("status") != "succeeded":
+        if record and record.get("retryable"):
+            st.warning("The evaluation service is busy right now, please try again in a moment.")
+        else:
+            st.error(f"Report generation failed: {(record or {}).get('error', 'unknown error')}")
+        return None
+    remember_usage(record["result"])
+    return record["result"]
 
 # ------------------------------------------------------
 # Function to handle conversation
-def handle_conversation(question, history):
+def handle_conversation(question):
     # Call the Lambda function and return the result
-    return call_lambda(question, history)
+    return call_lambda(question)
+
+# Record a turn answered without calling the model (e.g. a pre-generated report) in the stored session
+def record_turn(question, answer):
+    try:
+        append_session_history(get_session_id(), [
+            {"role": "user", "content": question},
+            {"role": "assistant", "content": answer},
+        ])
+    except requests.exceptions.RequestException as e:
+        st.error(f"Error saving conversation history: {e}")
+
+# Score the selected document per criterion and store the scores in the local comparison index
+def score_selected_document():
+    documents = get_document_scope()
+    if not documents:
+        st.sidebar.warning("Select an evaluation document to score.")
+        return
+    flight_key = request_key("scores", criteria_version(), documents=documents)
+    progress = st.sidebar.empty()
+    record = None
+    try:
+        # Scoring runs as an asynchronous job; scores appear as the model produces them
+        with st.spinner("Scoring tenderer against the evaluation criteria..."):
+            payload = {"mode": "scores", "documents": documents, "session_id": get_session_id(), "user_id": get_user_id()}
+            for record in stream_job(payload, flight_key):
+                if record.get("partial_scores"):
+                    progress.table([{"Criterion": score["criterion"], "Score": score["score"]}
+                                    for score in record["partial_scores"]])
+    except requests.exceptions.RequestException as e:
+        st.sidebar.error(f"Error calling Lambda: {e}")
+        return
+    finally:
+        progress.empty()
+    response = (record or {}).get("result") or {}
+    if "scores" not in response:
+        st.sidebar.error(f"Scoring failed: {(record or {}).get('error', 'No scores returned')}")
+        return
+    remember_usage(response)
+    tenderer = os.path.basename(documents[0])
+    get_score_index().upsert(tenderer, response["scores"], criteria_version())
+    st.sidebar.success(f"Stored {len(response['scores'])} criterion scores for {tenderer}.")
+
+# Ranking and comparison across tenderers, answered from the local score index
+def render_score_comparison():
+    score_index = get_score_index()
+    criteria = score_index.criteria()
+    if not criteria:
+        st.write("No scores stored yet.")
+        return
+    criterion = st.selectbox("Rank tenderers by criterion", criteria, key="rank_criterion")
+    st.table([{"Tenderer": tenderer, "Score": record["score"], "Max": record.get("max_score"),
+               "Evidence": record.get("evidence", "")} for tenderer, record in score_index.rank(criterion)])
+    tenderers = st.multiselect("Compare tenderers", score_index.tenderers(), key="compare_tenderers")
+    if tenderers:
+        comparison = score_index.compare(tenderers)
+        st.table([{"Criterion": name, **scores} for name, scores in comparison.items()])
+
+# Load the stored conversation when resuming a session from another app instance
+def load_session_messages():
+    session_id = get_session_id()
+    if not st.session_state.session_resumed:
+        return []
+    try:
+        return fetch_session_history(session_id)
+    except requests.exceptions.RequestException as e:
+        st.error(f"Error loading conversation history: {e}")
+        return []
 
 # ------------------------------------------------------
 # Streamlit Chat Message History
@@ -99,6 +174,8 @@ history = StreamlitChatMessageHistory(key="chat_messages")
 # Clear Chat History function
 def clear_chat_history():
     st.session_state.messages = [{"role": "assistant", "content": "Hello! I am your assistant for your Tender Evaluation. How can I help you?"}]
+    new_session_id()  # Start a fresh server-side conversation
+    st.session_state.pop("usage_totals", None)  # Usage is counted per conversation
     st.session_state.conversation_started = False  # Reset conversation state
     history.clear()
 
@@ -116,40 +193,24 @@ with st.sidebar:
     streaming_on = st.checkbox('Streaming')
     st.button('Clear Chat History', on_click=clear_chat_history)
     
-    # Display the conversation history logs as structured JSON-like objects
-    st.write("### History Logs")
-    if "messages" in st.session_state:
-        st.json(st.session_state.messages)  # Display the JSON-like format
-    else:
-        st.write("No history available.")
+    # Display the conversation history logs lazily, latest page only
+    render_history_log(st.session_state.get("messages", []))
+
+    # Structured per-criterion scores and cross-tenderer comparison
+    st.write("### Tenderer Scores")
+    if st.button('📊 Score Selected Document', key="score_button", help='Score the selected document against each criterion'):
+        score_selected_document()
+    with st.expander("Compare Tenderers"):
+        render_score_comparison()
 
 # Initialize session state for messages and conversation status if not already present
 if "messages" not in st.session_state:
-    st.session_state.messages = [{"role": "assistant", "content": "Hello! I am your assistant for your Tender Evaluation. How can I help you?"}]
+    st.session_state.messages = [{"role": "assistant", "content": "Hello! I am your assistant for your Tender Evaluation. How can I help you?"}] + load_session_messages()
 if "conversation_started" not in st.session_state:
-    st.session_state.conversation_started = False
-
-# Display previous messages in chat window
-for message in st.session_state.messages:
-    with st.chat_message(message["role"]):
-        st.write(message["content"])
-
-# Display citations if available (this will show the expander with sources after messages)
-def display_citations(context_data):
-    if context_data:
-        citations = extract_citations(context_data)
-        with st.expander("Show source details >"):
-            for citation in citations:
-                st.write("Page Content:", citation.page_content)
-                s3_uri = citation.metadata.get('location', {}).get('s3Location', {}).get('uri', "")
-                if s3_uri:
-                    bucket, key = parse_s3_uri(s3_uri)
-                    presigned_url = create_presigned_url(bucket, key)
-                    if presigned_url:
-                        st.markdown(f"Source: [{s3_uri}]({presigned_url})")
-                    else:
-                        st.write(f"Source: {s3_uri} (Presigned URL generation failed)")
-                st.write("Score:", citation.metadata.get('score', 'N/A'))
+    st.session_state.conversation_started = len(st.session_state.messages) > 1  # True for a resumed session
+
+# Display previous messages in chat window, collapsing older turns
+render_chat_history(st.session_state.messages)
 
 # Display the button only if the conversation hasn't started
 if not st.session_state.conversation_started:
@@ -157,16 +218,17 @@ if not st.session_state.conversation_started:
 
     # Action for Evaluate button click
     if evaluate_button:
-        st.session_state.messages.append({"role": "user", "content": "Generate a review and evaluation report of the Tenderer's proposal."})
+        st.session_state.messages.append({"role": "user", "content": STANDARD_REPORT_QUESTION})
         with st.chat_message("user"):
-            st.write("Generate a review and evaluation report of the Tenderer's proposal.")
+            st.write(STANDARD_REPORT_QUESTION)
 
-        # Prepare the chat history for the Lambda payload
-        history_payload = [{"role": msg["role"], "content": msg["content"]} for msg in st.session_state.messages[:-1]]
-
-        # Add a spinner while waiting for the Lambda response
-        with st.spinner("Waiting for response..."):
-            response = handle_conversation("Generate a review and evaluation report of the Tenderer's proposal.", history_payload)
+        # Use the report pre-generated after ingestion if it is ready, otherwise generate it now
+        response = get_cached_report(st.session_state.get("selected_eval_file"))
+        if response is not None:
+            record_turn(STANDARD_REPORT_QUESTION, response.get("response", ""))
+        else:
+            # Full reports can outlast the API Gateway timeout, so they run as a job
+            response = run_report_job(STANDARD_REPORT_QUESTION)
 
         if response:
             full_response = response.get("response", "No response")
@@ -186,7 +248,7 @@ if not st.session_state.conversation_started:
             st.session_state.messages.append({"role": "assistant", "content": full_response})
 
             # Display citations
-            display_citations(context_data)
+            render_citations(context_data)
 
         else:
             st.error("Failed to retrieve response from Lambda.")
@@ -194,6 +256,53 @@ if not st.session_state.conversation_started:
         # Mark conversation as started
         st.session_state.conversation_started = True
 
+# Checklist of questions answered in one batched request with shared retrieval
+def run_checklist(questions):
+    documents = get_document_scope()
+    flight_key = request_key("\n".join(questions), criteria_version(), documents=documents)
+    progress = st.empty()
+    record = None
+    try:
+        with st.spinner("Running checklist..."):
+            payload = {"mode": "batch", "questions": questions, "documents": documents,
+                       "session_id": get_session_id(), "user_id": get_user_id()}
+            for record in stream_job(payload, flight_key):
+                answered = len(record.get("partial_items") or [])
+                progress.progress(answered / len(set(questions)), text=f"{answered} of {len(set(questions))} answered")
+    except requests.exceptions.RequestException as e:
+        st.error(f"Error calling Lambda: {e}")
+        return
+    finally:
+        progress.empty()
+    if not record or record.get("status") != "succeeded":
+        st.error(f"Checklist failed: {(record or {}).get('error', 'unknown error')}")
+        return
+    remember_usage(record["result"])
+    st.session_state.checklist_result = record["result"]
+
+def render_checklist_result(result):
+    for item in result["items"]:
+        st.markdown(f"**{item['question']}**")
+        if item["status"] == "ok":
+            st.write(item["response"])
+        else:
+            st.error(item.get("error", "No answer"))
+        # Shown inline: this runs inside the checklist expander, and expanders cannot be nested
+        groups = prepare_citations([result["chunks"][chunk_id] for chunk_id in item["chunk_ids"]])
+        if groups:
+            st.caption("Sources")
+            st.markdown(citations_markdown(groups))
+
+with st.expander("📋 Run Checklist"):
+    checklist_text = st.text_area("Questions (one per line)", key="checklist_questions",
+                                  help="Compliance items, mandatory documents, pricing checks...")
+    if st.button("Run Checklist", key="checklist_button"):
+        checklist = [line.strip() for line in checklist_text.splitlines() if line.strip()]
+        if checklist:
+            run_checklist(checklist)
+    if "checklist_result" in st.session_state:
+        render_checklist_result(st.session_state.checklist_result)
+
 # Chat Input - User Prompt
 if prompt := st.chat_input():
     # Add user message to session state
@@ -201,12 +310,15 @@ if prompt := st.chat_input():
     with st.chat_message("user"):
         st.write(prompt)
 
-    # Prepare the chat history for the Lambda payload, excluding the current prompt
-    history_payload = [{"role": msg["role"], "content": msg["content"]} for msg in st.session_state.messages[:-1]]
-
-    # Add a spinner while waiting for the Lambda response
-    with st.spinner("Waiting for response..."):
-        response = handle_conversation(prompt, history_payload)
+    # Ranking questions over stored scores are answered from the local index without the model
+    indexed_answer = get_score_index().answer(prompt)
+    if indexed_answer:
+        response = {"response": indexed_answer, "context": []}
+        record_turn(prompt, indexed_answer)
+    else:
+        # Add a spinner while waiting for the Lambda response
+        with st.spinner("Waiting for response..."):
+            response = handle_conversation(prompt)
 
     if response:
         full_response = response.get("response", "No response")
@@ -224,7 +336,10 @@ if prompt := st.chat_input():
         st.session_state.messages.append({"role": "assistant", "content": full_response})
 
         # Display citations
-        display_citations(context_data)
+        render_citations(context_data)
 
     # Mark conversation as started if not already
     st.session_state.conversation_started = True
+
+# Running token usage and cost, including the answer just given
+render_usage_sidebar()